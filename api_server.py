@@ -247,10 +247,15 @@ async def get_appointment_results(session_id: str):
                 "patient_data": patient_hero.patient_data.to_dict()
             }
         else:
-            # Try to load from file if not in memory
+            # Try to load from file if not in memory: the scraper's JSON Lines output,
+            # else the JSON array saved by the CrewAI flow
             try:
-                with open('processed_medical_data_with_appointments.json', 'r') as f:
-                    appointment_data = json.load(f)
+                try:
+                    with open('processed_medical_data_with_appointments.ndjson', 'r') as f:
+                        appointment_data = [json.loads(line) for line in f if line.strip()]
+                except FileNotFoundError:
+                    with open('processed_medical_data_with_appointments.json', 'r') as f:
+                        appointment_data = json.load(f)
                 return {
                     "status": "success",
                     "session_id": session_id,
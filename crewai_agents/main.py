@@ -1,16 +1,18 @@
 import os
+import re
 import json
 import uuid
 import asyncio
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, List, Optional, Any, Union
+from typing import Dict, List, Optional, Any, Tuple, Union
 from dataclasses import dataclass, asdict
 from dotenv import load_dotenv
 
+import orjson
 import wandb
-
-wandb.login()
-
 import weave
 import google.generativeai as genai
 import requests
@@ -26,8 +28,68 @@ load_dotenv()
 # Configure Gemini API
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
-# Set the Weave team and project for tracing
-weave.init(os.getenv("WANDB_ENTITY", "mugiwara_luffy") + "/" + os.getenv("WANDB_PROJECT", "patienthero-crewai"))
+# WANDB_MODE=disabled skips login, tracing and per-interaction logging entirely
+_WANDB_ENABLED = os.getenv("WANDB_MODE", "online") != "disabled"
+
+if _WANDB_ENABLED:
+    wandb.login()
+    # Set the Weave team and project for tracing
+    weave.init(os.getenv("WANDB_ENTITY", "mugiwara_luffy") + "/" + os.getenv("WANDB_PROJECT", "patienthero-crewai"))
+
+# Persistent event loop for background jobs (appointment processing) started from sync code
+_BG_LOOP = asyncio.new_event_loop()
+threading.Thread(target=_BG_LOOP.run_forever, name="patienthero-bg-loop", daemon=True).start()
+
+# CrewAI verbose output prints every prompt/completion; opt in with CREWAI_VERBOSE=1
+_VERBOSE = os.getenv("CREWAI_VERBOSE", "0") == "1"
+
+# orjson options for the human-readable JSON files written on the save path
+_JSON_OPTS = orjson.OPT_INDENT_2
+
+def _to_gemini_contents(messages: List[Dict[str, str]]) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+    """Split chat messages into a Gemini system instruction and structured contents in one pass"""
+    system_instruction = None
+    contents = []
+    for msg in messages:
+        role = msg.get("role")
+        if role == "system":
+            system_instruction = msg["content"]
+        else:
+            contents.append({"role": "model" if role == "assistant" else "user", "parts": [msg["content"]]})
+    if not contents and system_instruction:
+        # Gemini needs at least one content turn
+        return None, [{"role": "user", "parts": [system_instruction]}]
+    return system_instruction, contents
+
+@functools.lru_cache(maxsize=32)
+def _gemini_model(model_name: str, system_instruction: Optional[str] = None) -> genai.GenerativeModel:
+    """Reuse GenerativeModel instances; CrewAI sends the same few agent system prompts every turn"""
+    return genai.GenerativeModel(model_name, system_instruction=system_instruction)
+
+_BASIC_INFO_FIELDS = frozenset({"medical_condition", "zip_code", "phone_number", "insurance"})
+
+# Fallback extraction patterns, compiled once at import
+_ZIP_RE = re.compile(r'\b\d{5}\b')
+# (555) 123-4567, 555-123-4567, 555.123.4567 or 5551234567
+_PHONE_RE = re.compile(r'(?:\(\d{3}\)\s*\d{3}[-.]?\d{4}|\b\d{3}[-.]?\d{3}[-.]?\d{4}\b)')
+_PHONE_DIGITS_RE = re.compile(r'\d')
+
+_MEDICAL_KEYWORDS = ['pain', 'ache', 'hurt', 'sick', 'condition', 'problem', 'headache', 'fever', 'nausea', 'dizzy', 'cough', 'cold', 'flu', 'infection', 'injury', 'broken', 'sprain', 'cut', 'burn', 'rash', 'allergy']
+_INSURANCE_KEYWORDS = ['insurance', 'aetna', 'blue cross', 'bluecross', 'medicare', 'medicaid', 'cigna', 'humana', 'anthem', 'kaiser', 'bcbs', 'united healthcare', 'unitedhealthcare']
+# Substring semantics (no word boundaries) to match "headaches", "hurts", etc. like the old keyword loop
+_MED_KW_RE = re.compile('|'.join(map(re.escape, _MEDICAL_KEYWORDS)), re.IGNORECASE)
+_INS_KW_RE = re.compile('|'.join(map(re.escape, _INSURANCE_KEYWORDS)), re.IGNORECASE)
+# All fallback patterns fused into one scan; match.lastgroup says which field was hit.
+# Phone precedes ZIP so a phone number is never split into a ZIP match.
+_FALLBACK_SCAN_RE = re.compile(
+    '|'.join(f'(?P<{name}>{pattern.pattern})' for name, pattern in (
+        ("phone_number", _PHONE_RE),
+        ("zip_code", _ZIP_RE),
+        ("medical_condition", _MED_KW_RE),
+        ("insurance", _INS_KW_RE),
+    )),
+    re.IGNORECASE
+)
 
 @dataclass
 class PatientData:
@@ -46,14 +108,45 @@ class PatientData:
         if self.conversation_history is None:
             self.conversation_history = []
     
+    def __setattr__(self, name: str, value: Any):
+        # Invalidate the cached completeness check whenever a basic field changes
+        if name in _BASIC_INFO_FIELDS:
+            self.__dict__["_basic_complete_cache"] = None
+        elif name == "symptoms":
+            self.__dict__.pop("_symptom_set", None)
+        super().__setattr__(name, value)
+    
+    @property
+    def basic_info_complete(self) -> bool:
+        """Whether all basic patient information is collected (cached until a basic field changes)"""
+        cached = self.__dict__.get("_basic_complete_cache")
+        if cached is None:
+            cached = all([
+                self.medical_condition,
+                self.zip_code,
+                self.phone_number,
+                self.insurance
+            ])
+            self.__dict__["_basic_complete_cache"] = cached
+        return cached
+    
     def is_basic_info_complete(self) -> bool:
         """Check if all basic patient information is collected"""
-        return all([
-            self.medical_condition,
-            self.zip_code,
-            self.phone_number,
-            self.insurance
-        ])
+        return self.basic_info_complete
+    
+    def add_symptom(self, symptom: str) -> bool:
+        """Append a symptom unless already recorded; returns True if it was added"""
+        if self.symptoms is None:
+            self.symptoms = []
+        # Shadow set for O(1) duplicate checks; kept out of the dataclass fields so to_dict() is unchanged
+        seen = self.__dict__.get("_symptom_set")
+        if seen is None:
+            seen = self.__dict__["_symptom_set"] = set(self.symptoms)
+        if symptom in seen:
+            return False
+        seen.add(symptom)
+        self.symptoms.append(symptom)
+        return True
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary for JSON serialization"""
@@ -66,8 +159,8 @@ class WandbWeaveMonitor:
         self.session_id = str(uuid.uuid4())
         
     @weave.op()
-    def log_agent_interaction(self, agent_name: str, input_data: str, output_data: str, metadata: Dict = None):
-        """Log agent interactions"""
+    def log_agent_interaction(self, agent_name: str, input_data: Union[str, Dict[str, Any]], output_data: str, metadata: Dict = None):
+        """Log agent interactions (structured input is passed through for Weave to serialize)"""
         interaction_data = {
             "session_id": self.session_id,
             "timestamp": datetime.now().isoformat(),
@@ -77,11 +170,18 @@ class WandbWeaveMonitor:
             "metadata": metadata or {}
         }
         
-        # Log to Wandb
-        wandb.log({
-            f"{agent_name}_interaction": interaction_data,
-            "timestamp": datetime.now().timestamp()
-        })
+        # Log a lightweight summary to Wandb; the full payload stays in the Weave trace
+        if _WANDB_ENABLED:
+            wandb.log({
+                f"{agent_name}_interaction": {
+                    "session_id": self.session_id,
+                    "agent_name": agent_name,
+                    "input_len": len(input_data) if isinstance(input_data, str) else None,
+                    "output_len": len(output_data),
+                    "step": interaction_data["metadata"].get("step")
+                },
+                "timestamp": datetime.now().timestamp()
+            })
         
         return interaction_data
     
@@ -93,16 +193,215 @@ class WandbWeaveMonitor:
             "timestamp": datetime.now().isoformat(),
             "crew_result": crew_result,
             "patient_data": patient_data.to_dict(),
-            "completion_status": patient_data.is_basic_info_complete()
+            "completion_status": patient_data.basic_info_complete
         }
         
-        wandb.log({
-            "crew_execution": execution_data,
-            "patient_data_complete": patient_data.is_basic_info_complete()
-        })
+        if _WANDB_ENABLED:
+            wandb.log({
+                "crew_execution": {
+                    "session_id": self.session_id,
+                    "crew_result_len": len(crew_result),
+                    "conversation_turns": len(patient_data.conversation_history),
+                    "completion_status": execution_data["completion_status"]
+                },
+                "patient_data_complete": execution_data["completion_status"]
+            })
         
         return execution_data
 
+@functools.lru_cache(maxsize=1)
+def _build_crews(model: str, api_key: str, temperature: float) -> Tuple[Crew, Crew, Crew, Agent]:
+    """Build agents, tasks and crews once per process; sessions only own patient data and monitoring"""
+    
+    # Initialize custom Gemini LLM for CrewAI
+    llm = GeminiLLM(
+        model=model,
+        api_key=api_key,
+        temperature=temperature
+    )
+    
+    # Agent 1: Chat Inference Model for basic patient information
+    chat_agent = Agent(
+        role="Patient Information Collector",
+        goal="Have a natural conversation with patients to gradually collect essential information including medical condition, zip code, phone number, and insurance details",
+        backstory="""You are a friendly and professional medical intake specialist having a real conversation with a patient. 
+        Your job is to gather basic patient information one piece at a time through natural dialogue. 
+        You should be empathetic, patient, and conversational. Ask for one piece of missing information at a time.
+        When a patient greets you, greet them back warmly and ask about what brings them in today.
+        Never generate fake conversations or made-up data - only respond to what the patient actually says.""",
+        verbose=_VERBOSE,
+        allow_delegation=False,
+        llm=llm
+    )
+    
+    # Agent 2: Reasoning Model for symptom analysis
+    reasoning_agent = Agent(
+        role="Medical Reasoning Specialist",
+        goal="Analyze patient's medical condition and dive deeper into possible symptoms and related health concerns",
+        backstory="""You are an experienced medical AI assistant specializing in 
+        symptom analysis and medical reasoning. Based on the patient's reported condition, 
+        you identify potential symptoms, ask relevant follow-up questions, and provide 
+        preliminary analysis. You are thorough, evidence-based, and always remind patients 
+        to consult with healthcare professionals.""",
+        verbose=_VERBOSE,
+        allow_delegation=False,
+        llm=llm
+    )
+    
+    # Agent 3: Data Extraction Specialist
+    extraction_agent = Agent(
+        role="Data Extraction Specialist",
+        goal="Extract and structure patient information from conversation data into standardized JSON format",
+        backstory="""You are an expert data extraction specialist with deep knowledge 
+        of medical terminology and patient information processing. Your role is to analyze 
+        conversation transcripts and extract all relevant patient data, organizing it into 
+        structured JSON format. You can identify medical conditions, personal information, 
+        symptoms, and other relevant data from natural language conversations. You ensure 
+        data accuracy and completeness while maintaining patient privacy standards.""",
+        verbose=_VERBOSE,
+        allow_delegation=False,
+        llm=llm
+    )
+    
+    # Tasks
+    chat_task = Task(
+        description="""You are having a conversation with a patient. Respond naturally to their input.
+        
+        Your goal is to gradually collect the following information through natural conversation:
+        1. Medical condition they are experiencing
+        2. ZIP code for location-based services  
+        3. Phone number for contact
+        4. Insurance information
+        
+        Based on the current patient data, determine what information is still needed and ask for ONE piece of missing information at a time. Be conversational, empathetic, and patient.
+        
+        If the user just says "Hi" or greets you, greet them back warmly and ask about their medical condition.
+        If they provide information, acknowledge it and ask for the next missing piece.
+        
+        Current user input: {user_input}
+        Current patient data: {current_data}
+        
+        Respond with a natural, conversational message - NOT a JSON object or structured data.
+        """,
+        agent=chat_agent,
+        expected_output="A natural conversational response to the patient"
+    )
+    
+    reasoning_task = Task(
+        description="""You are now analyzing symptoms for a patient whose basic information has been collected.
+        
+        Based on the patient's reported medical condition and any new symptoms they mention, perform analysis:
+        1. Identify potential symptoms associated with the condition
+        2. Ask relevant follow-up questions about symptoms they've mentioned
+        3. Provide preliminary medical reasoning (while emphasizing need for professional consultation)
+        4. Suggest what additional information might be helpful
+        
+        If this is the initial reasoning analysis (user_input contains "Let's analyze your condition"), provide a comprehensive initial assessment and ask specific questions about their symptoms.
+        If the patient mentions new symptoms, acknowledge them and dive deeper into those specific symptoms.
+        Be conversational and empathetic while gathering more detailed symptom information.
+        
+        Patient's medical condition: {medical_condition}
+        Current user input: {user_input}
+        Current patient data: {current_data}
+        
+        Respond with a natural, conversational message focusing on symptom analysis.
+        """,
+        agent=reasoning_agent,
+        expected_output="Detailed symptom analysis, follow-up questions, and medical reasoning in conversational format"
+    )
+    
+    extraction_task = Task(
+        description="""Extract and structure all patient information from the conversation data:
+        
+        Analyze the complete conversation history and extract:
+        1. Personal Information:
+           - Name (if mentioned)
+           - Age (if mentioned)
+           - Phone number
+           - Address/ZIP code
+           - Insurance information
+        
+        2. Medical Information:
+           - Primary medical condition/complaint
+           - Symptoms mentioned
+           - Severity indicators
+           - Duration of symptoms
+           - Previous treatments mentioned
+           - Medications mentioned
+           - Allergies mentioned
+        
+        3. Additional Context:
+           - Emergency contact information
+           - Preferred language
+           - Accessibility needs
+           - Any other relevant information
+        
+        Output the extracted data in the following JSON format:
+        {{
+            "personal_info": {{
+                "name": "string or null",
+                "age": "string or null",
+                "phone": "string or null",
+                "zip_code": "string or null",
+                "address": "string or null",
+                "insurance": "string or null",
+                "emergency_contact": "string or null"
+            }},
+            "medical_info": {{
+                "primary_condition": "string or null",
+                "symptoms": ["array of symptoms"],
+                "severity": "string or null",
+                "duration": "string or null",
+                "previous_treatments": ["array of treatments"],
+                "current_medications": ["array of medications"],
+                "allergies": ["array of allergies"]
+            }},
+            "additional_context": {{
+                "preferred_language": "string or null",
+                "accessibility_needs": "string or null",
+                "notes": "string or null"
+            }},
+            "extraction_confidence": {{
+                "personal_info_confidence": "high/medium/low",
+                "medical_info_confidence": "high/medium/low",
+                "overall_completeness": "percentage"
+            }}
+        }}
+        
+        Conversation history: {conversation_history}
+        Current extracted data: {current_data}
+        """,
+        agent=extraction_agent,
+        expected_output="Complete structured JSON data with all extracted patient information and confidence scores"
+    )
+    
+    # Chat crew for basic information collection
+    chat_crew = Crew(
+        agents=[chat_agent],
+        tasks=[chat_task],
+        process=Process.sequential,
+        verbose=_VERBOSE
+    )
+    
+    # Reasoning crew for symptom analysis
+    reasoning_crew = Crew(
+        agents=[reasoning_agent],
+        tasks=[reasoning_task],
+        process=Process.sequential,
+        verbose=_VERBOSE
+    )
+    
+    # Extraction crew for data structuring
+    extraction_crew = Crew(
+        agents=[extraction_agent],
+        tasks=[extraction_task],
+        process=Process.sequential,
+        verbose=_VERBOSE
+    )
+    
+    return chat_crew, reasoning_crew, extraction_crew, extraction_agent
+
+
 class PatientHeroCrewAI:
     """Main class for managing CrewAI agents with Wandb Weave monitoring"""
     
@@ -116,37 +415,42 @@ class PatientHeroCrewAI:
         # Initialize ExaHelper for direct processing
         self.exa_helper = ExaHelper()
         
+        # Single writer thread so file saves never block the response path
+        # and appends to the same JSON file stay ordered
+        self._io_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="patienthero-io")
+        # Network-bound Exa lookups run separately so they don't hold up the writer thread
+        self._exa_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="patienthero-exa")
+        
+        # Last structured extraction, keyed by conversation length
+        self._extract_cache_key = None
+        self._extract_cache_val = None
+        
         # Initialize Wandb run
-        wandb.init(
-            project=os.getenv("WANDB_PROJECT", "patienthero-crewai"),
-            entity=os.getenv("WANDB_ENTITY"),
-            config={
-                "model": "gemini-2.5-flash",
-                "session_id": self.monitor.session_id,
-                "inference_provider": "google-gemini"
-            }
-        )
+        if _WANDB_ENABLED:
+            wandb.init(
+                project=os.getenv("WANDB_PROJECT", "patienthero-crewai"),
+                entity=os.getenv("WANDB_ENTITY"),
+                config={
+                    "model": "gemini-2.5-flash",
+                    "session_id": self.monitor.session_id,
+                    "inference_provider": "google-gemini"
+                }
+            )
         
-        # Initialize custom Gemini LLM for CrewAI
-        self.llm = GeminiLLM(
-            model="gemini-2.5-flash",
-            api_key=os.getenv("GEMINI_API_KEY"),
-            temperature=0.7
+        # Agents and crews are immutable across sessions, so share one process-wide set
+        self.chat_crew, self.reasoning_crew, self.extraction_crew, self.extraction_agent = _build_crews(
+            "gemini-2.5-flash", os.getenv("GEMINI_API_KEY"), 0.7
         )
-        
-        self._create_agents()
-        self._create_tasks()
-        self._create_crew()
 
-    def _pass_to_exa_helper(self):
-        """Pass medical data directly to ExaHelper for processing"""
+    def _pass_to_exa_helper(self, patient_dict: Dict[str, Any]):
+        """Pass a patient data snapshot directly to ExaHelper for processing"""
         try:
             medical_data = {
-                "medical_condition": self.patient_data.medical_condition,
-                "zip_code": self.patient_data.zip_code,
-                "insurance": self.patient_data.insurance,
-                "phone_suffix": ''.join(filter(str.isdigit, self.patient_data.phone_number or ""))[-4:] if self.patient_data.phone_number else "0000",
-                "session_id": self.patient_data.session_id,
+                "medical_condition": patient_dict["medical_condition"],
+                "zip_code": patient_dict["zip_code"],
+                "insurance": patient_dict["insurance"],
+                "phone_suffix": ''.join(_PHONE_DIGITS_RE.findall(patient_dict["phone_number"])[-4:]) if patient_dict["phone_number"] else "0000",
+                "session_id": patient_dict["session_id"],
                 "timestamp": datetime.now().isoformat()
             }
             
@@ -176,33 +480,13 @@ class PatientHeroCrewAI:
                 # Import and run appointment processing
                 from process_clinics_parallel import process_medical_institutions_for_api
                 
-                # Use asyncio.create_task instead of run_until_complete to avoid loop conflict
-                try:
-                    # Try to get existing loop
-                    current_loop = asyncio.get_running_loop()
-                    # Schedule the appointment processing as a background task
-                    task = current_loop.create_task(process_medical_institutions_for_api())
-                    print(f"📅 Appointment processing started in background...")
-                    # Store the task for later retrieval
-                    self.appointment_task = task
-                except RuntimeError:
-                    # No loop running, create new one
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-                    appointment_results = loop.run_until_complete(process_medical_institutions_for_api())
-                    
-                    if appointment_results:
-                        print(f"✅ Successfully processed {len(appointment_results)} hospitals with appointment data")
-                        # Store appointment results for later use
-                        self.appointment_results = appointment_results
-                        
-                        # Save appointment results to a separate file for frontend access
-                        with open('processed_medical_data_with_appointments.json', 'w') as f:
-                            json.dump(appointment_results, f, indent=2)
-                        print(f"💾 Appointment data saved to processed_medical_data_with_appointments.json")
-                    else:
-                        print(f"⚠️ No appointment data found during processing")
-                        
+                # Schedule on the shared background loop so the caller never blocks on scraping
+                future = asyncio.run_coroutine_threadsafe(process_medical_institutions_for_api(), _BG_LOOP)
+                future.add_done_callback(self._on_appointments_processed)
+                print(f"📅 Appointment processing started in background...")
+                # Store the future for later retrieval
+                self.appointment_task = future
+                
             except Exception as appointment_error:
                 print(f"⚠️ Error during appointment processing: {appointment_error}")
                 # Continue with normal flow even if appointment processing fails
@@ -213,191 +497,39 @@ class PatientHeroCrewAI:
             print(f"⚠️ Error processing data with ExaHelper: {e}")
             return None
     
-    def _create_agents(self):
-        """Create the three CrewAI agents"""
-        
-        # Agent 1: Chat Inference Model for basic patient information
-        self.chat_agent = Agent(
-            role="Patient Information Collector",
-            goal="Have a natural conversation with patients to gradually collect essential information including medical condition, zip code, phone number, and insurance details",
-            backstory="""You are a friendly and professional medical intake specialist having a real conversation with a patient. 
-            Your job is to gather basic patient information one piece at a time through natural dialogue. 
-            You should be empathetic, patient, and conversational. Ask for one piece of missing information at a time.
-            When a patient greets you, greet them back warmly and ask about what brings them in today.
-            Never generate fake conversations or made-up data - only respond to what the patient actually says.""",
-            verbose=True,
-            allow_delegation=False,
-            llm=self.llm
-        )
-        
-        # Agent 2: Reasoning Model for symptom analysis
-        self.reasoning_agent = Agent(
-            role="Medical Reasoning Specialist",
-            goal="Analyze patient's medical condition and dive deeper into possible symptoms and related health concerns",
-            backstory="""You are an experienced medical AI assistant specializing in 
-            symptom analysis and medical reasoning. Based on the patient's reported condition, 
-            you identify potential symptoms, ask relevant follow-up questions, and provide 
-            preliminary analysis. You are thorough, evidence-based, and always remind patients 
-            to consult with healthcare professionals.""",
-            verbose=True,
-            allow_delegation=False,
-            llm=self.llm
-        )
-        
-        # Agent 3: Data Extraction Specialist
-        self.extraction_agent = Agent(
-            role="Data Extraction Specialist",
-            goal="Extract and structure patient information from conversation data into standardized JSON format",
-            backstory="""You are an expert data extraction specialist with deep knowledge 
-            of medical terminology and patient information processing. Your role is to analyze 
-            conversation transcripts and extract all relevant patient data, organizing it into 
-            structured JSON format. You can identify medical conditions, personal information, 
-            symptoms, and other relevant data from natural language conversations. You ensure 
-            data accuracy and completeness while maintaining patient privacy standards.""",
-            verbose=True,
-            allow_delegation=False,
-            llm=self.llm
-        )
+    def _on_appointments_processed(self, future):
+        """Persist appointment results once background processing finishes"""
+        try:
+            appointment_results = future.result()
+        except Exception as appointment_error:
+            print(f"⚠️ Error during appointment processing: {appointment_error}")
+            return
+        
+        if appointment_results:
+            print(f"✅ Successfully processed {len(appointment_results)} hospitals with appointment data")
+            # Store appointment results for later use
+            self.appointment_results = appointment_results
+            # Save on the I/O thread rather than the background loop
+            self._submit_io(self._save_appointment_results, appointment_results)
+        else:
+            print(f"⚠️ No appointment data found during processing")
     
-    def _create_tasks(self):
-        """Create tasks for each agent"""
-        
-        self.chat_task = Task(
-            description="""You are having a conversation with a patient. Respond naturally to their input.
-            
-            Your goal is to gradually collect the following information through natural conversation:
-            1. Medical condition they are experiencing
-            2. ZIP code for location-based services  
-            3. Phone number for contact
-            4. Insurance information
-            
-            Based on the current patient data, determine what information is still needed and ask for ONE piece of missing information at a time. Be conversational, empathetic, and patient.
-            
-            If the user just says "Hi" or greets you, greet them back warmly and ask about their medical condition.
-            If they provide information, acknowledge it and ask for the next missing piece.
-            
-            Current user input: {user_input}
-            Current patient data: {current_data}
-            
-            Respond with a natural, conversational message - NOT a JSON object or structured data.
-            """,
-            agent=self.chat_agent,
-            expected_output="A natural conversational response to the patient"
-        )
-        
-        self.reasoning_task = Task(
-            description="""You are now analyzing symptoms for a patient whose basic information has been collected.
-            
-            Based on the patient's reported medical condition and any new symptoms they mention, perform analysis:
-            1. Identify potential symptoms associated with the condition
-            2. Ask relevant follow-up questions about symptoms they've mentioned
-            3. Provide preliminary medical reasoning (while emphasizing need for professional consultation)
-            4. Suggest what additional information might be helpful
-            
-            If this is the initial reasoning analysis (user_input contains "Let's analyze your condition"), provide a comprehensive initial assessment and ask specific questions about their symptoms.
-            If the patient mentions new symptoms, acknowledge them and dive deeper into those specific symptoms.
-            Be conversational and empathetic while gathering more detailed symptom information.
-            
-            Patient's medical condition: {medical_condition}
-            Current user input: {user_input}
-            Current patient data: {current_data}
-            
-            Respond with a natural, conversational message focusing on symptom analysis.
-            """,
-            agent=self.reasoning_agent,
-            expected_output="Detailed symptom analysis, follow-up questions, and medical reasoning in conversational format"
-        )
-        
-        self.extraction_task = Task(
-            description="""Extract and structure all patient information from the conversation data:
-            
-            Analyze the complete conversation history and extract:
-            1. Personal Information:
-               - Name (if mentioned)
-               - Age (if mentioned)
-               - Phone number
-               - Address/ZIP code
-               - Insurance information
-            
-            2. Medical Information:
-               - Primary medical condition/complaint
-               - Symptoms mentioned
-               - Severity indicators
-               - Duration of symptoms
-               - Previous treatments mentioned
-               - Medications mentioned
-               - Allergies mentioned
-            
-            3. Additional Context:
-               - Emergency contact information
-               - Preferred language
-               - Accessibility needs
-               - Any other relevant information
-            
-            Output the extracted data in the following JSON format:
-            {{
-                "personal_info": {{
-                    "name": "string or null",
-                    "age": "string or null",
-                    "phone": "string or null",
-                    "zip_code": "string or null",
-                    "address": "string or null",
-                    "insurance": "string or null",
-                    "emergency_contact": "string or null"
-                }},
-                "medical_info": {{
-                    "primary_condition": "string or null",
-                    "symptoms": ["array of symptoms"],
-                    "severity": "string or null",
-                    "duration": "string or null",
-                    "previous_treatments": ["array of treatments"],
-                    "current_medications": ["array of medications"],
-                    "allergies": ["array of allergies"]
-                }},
-                "additional_context": {{
-                    "preferred_language": "string or null",
-                    "accessibility_needs": "string or null",
-                    "notes": "string or null"
-                }},
-                "extraction_confidence": {{
-                    "personal_info_confidence": "high/medium/low",
-                    "medical_info_confidence": "high/medium/low",
-                    "overall_completeness": "percentage"
-                }}
-            }}
-            
-            Conversation history: {conversation_history}
-            Current extracted data: {current_data}
-            """,
-            agent=self.extraction_agent,
-            expected_output="Complete structured JSON data with all extracted patient information and confidence scores"
-        )
+    def _save_appointment_results(self, appointment_results: List[Dict[str, Any]]):
+        """Save appointment results to a separate file for frontend access"""
+        with open('processed_medical_data_with_appointments.json', 'wb') as f:
+            f.write(orjson.dumps(appointment_results, option=_JSON_OPTS))
+        print(f"💾 Appointment data saved to processed_medical_data_with_appointments.json")
     
-    def _create_crew(self):
-        """Create separate crews for different phases"""
-        # Chat crew for basic information collection
-        self.chat_crew = Crew(
-            agents=[self.chat_agent],
-            tasks=[self.chat_task],
-            process=Process.sequential,
-            verbose=True
-        )
+    def _submit_io(self, fn, *args) -> Future:
+        """Run a blocking save on the I/O thread and report failures"""
+        future = self._io_pool.submit(fn, *args)
         
-        # Reasoning crew for symptom analysis
-        self.reasoning_crew = Crew(
-            agents=[self.reasoning_agent],
-            tasks=[self.reasoning_task],
-            process=Process.sequential,
-            verbose=True
-        )
+        def _report(done: Future):
+            if done.exception():
+                print(f"⚠️ Background save failed: {done.exception()}")
         
-        # Extraction crew for data structuring
-        self.extraction_crew = Crew(
-            agents=[self.extraction_agent],
-            tasks=[self.extraction_task],
-            process=Process.sequential,
-            verbose=True
-        )
+        future.add_done_callback(_report)
+        return future
     
     @weave.op()
     def process_user_input(self, user_input: str) -> Dict[str, Any]:
@@ -418,7 +550,7 @@ class PatientHeroCrewAI:
             {"step": "user_input"}
         )
         
-        if not self.patient_data.is_basic_info_complete():
+        if not self.patient_data.basic_info_complete:
             # Use chat agent to collect basic information
             response = self._collect_basic_info(user_input)
             return response
@@ -452,7 +584,7 @@ class PatientHeroCrewAI:
             "chat_agent",
             user_input,
             str(result),
-            {"step": "basic_info_collection", "data_complete": self.patient_data.is_basic_info_complete()}
+            {"step": "basic_info_collection", "data_complete": self.patient_data.basic_info_complete}
         )
         
         # Extract and update patient data from user input using extraction agent
@@ -466,7 +598,7 @@ class PatientHeroCrewAI:
         })
         
         # Check if we now have complete basic info after this interaction
-        basic_info_complete = self.patient_data.is_basic_info_complete()
+        basic_info_complete = self.patient_data.basic_info_complete
         
         response = {
             "agent": "chat_agent",
@@ -477,7 +609,7 @@ class PatientHeroCrewAI:
         
         # Save data and notify if basic info is complete
         if basic_info_complete:
-            self._save_patient_data()
+            self._submit_io(self._save_patient_data, self.patient_data.to_dict())
             print(f"\n✅ Basic patient information collection complete!")
             print(f"📋 Collected: Medical condition, ZIP code, phone number, and insurance")
             print(f"🔄 Switching to Reasoning Agent for symptom analysis...")
@@ -536,7 +668,7 @@ class PatientHeroCrewAI:
         })
         
         # Save updated data
-        self._save_patient_data()
+        self._submit_io(self._save_patient_data, self.patient_data.to_dict())
         
         # Log complete crew execution
         self.monitor.log_crew_execution(str(result), self.patient_data)
@@ -554,6 +686,11 @@ class PatientHeroCrewAI:
     def _extract_structured_data(self) -> Dict[str, Any]:
         """Extract structured data using the extraction agent"""
         
+        # Skip the LLM round-trip if nothing was said since the last extraction
+        cache_key = len(self.patient_data.conversation_history)
+        if cache_key == self._extract_cache_key:
+            return self._extract_cache_val
+        
         # Prepare context for extraction agent
         extraction_input = {
             "conversation_history": self.patient_data.conversation_history,
@@ -566,7 +703,7 @@ class PatientHeroCrewAI:
         # Log extraction agent interaction
         self.monitor.log_agent_interaction(
             "extraction_agent",
-            json.dumps(extraction_input, indent=2),
+            extraction_input,
             str(result),
             {"step": "data_extraction", "conversation_length": len(self.patient_data.conversation_history)}
         )
@@ -575,7 +712,6 @@ class PatientHeroCrewAI:
         try:
             if isinstance(result, str):
                 # Extract JSON from the result if it's embedded in text
-                import re
                 json_match = re.search(r'\{.*\}', result, re.DOTALL)
                 if json_match:
                     structured_data = json.loads(json_match.group())
@@ -610,12 +746,13 @@ class PatientHeroCrewAI:
         }
         
         # Save the extracted data
-        self._save_extracted_data(structured_data)
+        self._submit_io(self._save_extracted_data, structured_data, list(self.patient_data.conversation_history))
         
+        self._extract_cache_key, self._extract_cache_val = cache_key, structured_data
         return structured_data
     
-    def _save_extracted_data(self, extracted_data: Dict[str, Any]):
-        """Save extracted structured data to a separate JSON file"""
+    def _save_extracted_data(self, extracted_data: Dict[str, Any], raw_conversation: List[Dict[str, str]]):
+        """Save extracted structured data to a separate JSON file (runs on the I/O thread)"""
         output_path = os.getenv("EXTRACTED_DATA_OUTPUT_PATH", "./extracted_patient_data.json")
         
         # Create extraction entry
@@ -623,15 +760,15 @@ class PatientHeroCrewAI:
             "session_id": self.patient_data.session_id,
             "timestamp": datetime.now().isoformat(),
             "extracted_data": extracted_data,
-            "raw_conversation": self.patient_data.conversation_history
+            "raw_conversation": raw_conversation
         }
         
         # Load existing extractions
         existing_extractions = []
         if os.path.exists(output_path):
             try:
-                with open(output_path, 'r') as f:
-                    existing_extractions = json.load(f)
+                with open(output_path, 'rb') as f:
+                    existing_extractions = orjson.loads(f.read())
             except json.JSONDecodeError:
                 existing_extractions = []
         
@@ -639,8 +776,8 @@ class PatientHeroCrewAI:
         existing_extractions.append(extraction_entry)
         
         # Save updated extractions
-        with open(output_path, 'w') as f:
-            json.dump(existing_extractions, f, indent=2)
+        with open(output_path, 'wb') as f:
+            f.write(orjson.dumps(existing_extractions, option=_JSON_OPTS))
         
         print(f"Extracted data saved to {output_path}")
 
@@ -689,7 +826,6 @@ class PatientHeroCrewAI:
             result = temp_extraction_crew.kickoff()
             
             # Parse the extraction result
-            import re
             json_match = re.search(r'\{.*\}', str(result), re.DOTALL)
             if json_match:
                 extracted_data = json.loads(json_match.group())
@@ -714,11 +850,8 @@ class PatientHeroCrewAI:
                     
                     # Handle additional symptoms
                     if extracted_data.get("additional_symptoms"):
-                        if not self.patient_data.symptoms:
-                            self.patient_data.symptoms = []
                         for symptom in extracted_data["additional_symptoms"]:
-                            if symptom not in self.patient_data.symptoms:
-                                self.patient_data.symptoms.append(symptom)
+                            if self.patient_data.add_symptom(symptom):
                                 print(f"✅ Added symptom: {symptom}")
                     
                     # If we got symptoms but no medical condition, and this is the first interaction,
@@ -739,43 +872,39 @@ class PatientHeroCrewAI:
     
     def _simple_data_extraction(self, user_input: str):
         """Fallback simple extraction method"""
-        user_input_lower = user_input.lower()
-        import re
+        
+        # Nothing left to capture
+        if self.patient_data.basic_info_complete:
+            return
+        
+        # Scan the input once, keeping the first hit for each field and stopping
+        # as soon as every still-missing field has one
+        missing = {name for name in _BASIC_INFO_FIELDS if not getattr(self.patient_data, name)}
+        hits = {}
+        for match in _FALLBACK_SCAN_RE.finditer(user_input):
+            hits.setdefault(match.lastgroup, match.group())
+            if missing.issubset(hits):
+                break
         
         # Extract medical condition (more comprehensive keywords)
-        if not self.patient_data.medical_condition:
-            medical_keywords = ['pain', 'ache', 'hurt', 'sick', 'condition', 'problem', 'headache', 'fever', 'nausea', 'dizzy', 'cough', 'cold', 'flu', 'infection', 'injury', 'broken', 'sprain', 'cut', 'burn', 'rash', 'allergy']
-            if any(word in user_input_lower for word in medical_keywords):
-                self.patient_data.medical_condition = user_input.strip()
-                print(f"📝 Medical condition captured: {self.patient_data.medical_condition}")
+        if not self.patient_data.medical_condition and "medical_condition" in hits:
+            self.patient_data.medical_condition = user_input.strip()
+            print(f"📝 Medical condition captured: {self.patient_data.medical_condition}")
         
         # Extract ZIP code (5 digit pattern)
-        if not self.patient_data.zip_code:
-            zip_match = re.search(r'\b\d{5}\b', user_input)
-            if zip_match:
-                self.patient_data.zip_code = zip_match.group()
-                print(f"📍 ZIP code captured: {self.patient_data.zip_code}")
+        if not self.patient_data.zip_code and "zip_code" in hits:
+            self.patient_data.zip_code = hits["zip_code"]
+            print(f"📍 ZIP code captured: {self.patient_data.zip_code}")
         
         # Extract phone number (various formats)
-        if not self.patient_data.phone_number:
-            phone_patterns = [
-                r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b',  # 555-123-4567 or 555.123.4567 or 5551234567
-                r'\(\d{3}\)\s*\d{3}[-.]?\d{4}',   # (555) 123-4567
-                r'\b\d{10}\b'                      # 5551234567
-            ]
-            for pattern in phone_patterns:
-                phone_match = re.search(pattern, user_input)
-                if phone_match:
-                    self.patient_data.phone_number = phone_match.group()
-                    print(f"📞 Phone number captured: {self.patient_data.phone_number}")
-                    break
+        if not self.patient_data.phone_number and "phone_number" in hits:
+            self.patient_data.phone_number = hits["phone_number"]
+            print(f"📞 Phone number captured: {self.patient_data.phone_number}")
         
         # Extract insurance (keywords and providers)
-        if not self.patient_data.insurance:
-            insurance_keywords = ['insurance', 'aetna', 'blue cross', 'bluecross', 'medicare', 'medicaid', 'cigna', 'humana', 'anthem', 'kaiser', 'bcbs', 'united healthcare', 'unitedhealthcare']
-            if any(word in user_input_lower for word in insurance_keywords):
-                self.patient_data.insurance = user_input.strip()
-                print(f"🏥 Insurance captured: {self.patient_data.insurance}")
+        if not self.patient_data.insurance and "insurance" in hits:
+            self.patient_data.insurance = user_input.strip()
+            print(f"🏥 Insurance captured: {self.patient_data.insurance}")
     
     def _display_collection_progress(self):
         """Display progress of information collection"""
@@ -794,81 +923,81 @@ class PatientHeroCrewAI:
         else:
             print(f"✅ All basic information collected!")
     
-    def _save_patient_data(self):
-        """Save patient data to JSON file with phone number suffix"""
+    def _save_patient_data(self, patient_dict: Dict[str, Any]):
+        """Append a patient data snapshot to a JSON Lines file with phone number suffix (runs on the I/O thread)"""
         # Generate filename based on last 4 digits of phone number
         phone_suffix = "0000"  # Default suffix
-        if self.patient_data.phone_number:
+        if patient_dict["phone_number"]:
             # Extract last 4 digits from phone number
-            phone_digits = ''.join(filter(str.isdigit, self.patient_data.phone_number))
+            phone_digits = _PHONE_DIGITS_RE.findall(patient_dict["phone_number"])
             if len(phone_digits) >= 4:
-                phone_suffix = phone_digits[-4:]
+                phone_suffix = ''.join(phone_digits[-4:])
         
-        output_path = f"./patient_data_{phone_suffix}.json"
+        output_path = f"./patient_data_{phone_suffix}.jsonl"
         
-        # Load existing data for this phone number
-        existing_data = []
-        if os.path.exists(output_path):
-            try:
-                with open(output_path, 'r') as f:
-                    existing_data = json.load(f)
-            except json.JSONDecodeError:
-                existing_data = []
-        
-        # Add current patient data
-        existing_data.append(self.patient_data.to_dict())
-        
-        # Save updated data
-        with open(output_path, 'w') as f:
-            json.dump(existing_data, f, indent=2)
+        # One record per line, so each save is an append instead of a full rewrite
+        with open(output_path, 'ab') as f:
+            f.write(orjson.dumps(patient_dict) + b"\n")
         
         print(f"Patient data saved to {output_path}")
         
-        # Pass medical data to ExaHelper if basic info is complete
-        if self.patient_data.is_basic_info_complete():
-            self._pass_to_exa_helper()
-            # --- New: Save ExaHelper result to JSON file ---
-            try:
-                exa_result = self.search_nearby_institutions(
-                    self.patient_data.medical_condition,
-                    self.patient_data.zip_code,
-                    self.patient_data.insurance
-                )
-                exa_output_path = f"./institutions_{phone_suffix}.json"
-                with open(exa_output_path, 'w') as f:
-                    json.dump(exa_result, f, indent=2)
-                print(f"Nearby institutions saved to {exa_output_path}")
-            except Exception as e:
-                print(f"⚠️ Error saving Exa institutions: {e}")
+        # Pass medical data to ExaHelper if basic info was complete when the snapshot was taken,
+        # and save the institutions it finds from that same single search
+        if all(patient_dict[field] for field in _BASIC_INFO_FIELDS):
+            exa_future = self._exa_pool.submit(self._pass_to_exa_helper, patient_dict)
+            exa_output_path = f"./institutions_{phone_suffix}.json"
+            exa_future.add_done_callback(lambda future: self._save_institutions(future, exa_output_path))
+    
+    def _save_institutions(self, exa_future: Future, exa_output_path: str):
+        """Write the nearby-institutions result once the Exa search finishes"""
+        try:
+            exa_result = exa_future.result()
+            if exa_result is None:
+                # _pass_to_exa_helper already reported the failure
+                return
+            # Stream one element at a time instead of materializing the whole pretty-printed array
+            with open(exa_output_path, 'wb') as f:
+                f.write(b'[')
+                for i, institution in enumerate(exa_result):
+                    f.write(b',\n' if i else b'\n')
+                    f.write(orjson.dumps(institution))
+                f.write(b'\n]\n')
+            print(f"Nearby institutions saved to {exa_output_path}")
+        except Exception as e:
+            print(f"⚠️ Error saving Exa institutions: {e}")
+    
+    def search_nearby_institutions(self, medical_condition: str, zip_code: str, insurance: str = None) -> list:
+        """Search for nearby hospitals/institutions using ExaHelper (.org/.gov only)."""
+        medical_data = {
+            "medical_condition": medical_condition,
+            "zip_code": zip_code,
+            "insurance": insurance or "",
+            "phone_suffix": "0000",
+            "session_id": self.patient_data.session_id,
+            "timestamp": datetime.now().isoformat()
+        }
+        return self.exa_helper.process_patient_from_main(medical_data)
     
     def get_patient_status(self) -> Dict[str, Any]:
         """Get current patient data status"""
+        basic_info_complete = self.patient_data.basic_info_complete
         return {
             "session_id": self.patient_data.session_id,
-            "basic_info_complete": self.patient_data.is_basic_info_complete(),
+            "basic_info_complete": basic_info_complete,
             "patient_data": self.patient_data.to_dict(),
-            "next_step": "reasoning_analysis" if self.patient_data.is_basic_info_complete() else "continue_basic_info"
+            "next_step": "reasoning_analysis" if basic_info_complete else "continue_basic_info"
         }
     
     @weave.op()
     def run_llm_chat(self, messages: List[Dict[str, str]], context: str = "") -> str:
         """Trace LLM calls with Weave using Google Gemini API"""
         try:
-            # Initialize Gemini model
-            model = genai.GenerativeModel('gemini-2.5-flash')
-            
             # Convert messages to Gemini format
-            if messages and messages[0].get("role") == "system":
-                # Use system message as context and combine with user message
-                system_msg = messages[0]["content"]
-                user_msgs = [msg["content"] for msg in messages[1:] if msg.get("role") == "user"]
-                prompt = f"System: {system_msg}\n\nUser: {' '.join(user_msgs)}"
-            else:
-                # Just use user messages
-                user_msgs = [msg["content"] for msg in messages if msg.get("role") == "user"]
-                prompt = ' '.join(user_msgs)
+            system_instruction, contents = _to_gemini_contents(messages)
+            
+            model = _gemini_model('gemini-2.5-flash', system_instruction)
             
-            response = model.generate_content(prompt)
+            response = model.generate_content(contents)
             
             # Check if response was blocked or empty
             if not response.text or response.text.strip() == "":
@@ -892,6 +1021,18 @@ class GeminiLLM(BaseLLM):
         self.model_name = model
         genai.configure(api_key=api_key)
         
+        # Built once and reused for every call
+        self._generation_config = genai.types.GenerationConfig(
+            temperature=self.temperature,
+            max_output_tokens=1500,
+        )
+        self._safety_settings = [
+            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
+        ]
+        
     def call(
         self,
         messages: Union[str, List[Dict[str, str]]],
@@ -902,37 +1043,19 @@ class GeminiLLM(BaseLLM):
     ) -> Union[str, Any]:
         """Call the Google Gemini API with the given messages."""
         try:
-            # Initialize Gemini model
-            model = genai.GenerativeModel(self.model_name)
-            
-            # Convert messages to prompt format
+            # Convert messages to Gemini format
             if isinstance(messages, str):
-                prompt = messages
+                system_instruction, contents = None, messages
             else:
-                # Convert message list to prompt
-                if messages and messages[0].get("role") == "system":
-                    # Use system message as context and combine with user message
-                    system_msg = messages[0]["content"]
-                    user_msgs = [msg["content"] for msg in messages[1:] if msg.get("role") == "user"]
-                    prompt = f"System: {system_msg}\n\nUser: {' '.join(user_msgs)}"
-                else:
-                    # Just use user messages
-                    user_msgs = [msg["content"] for msg in messages if msg.get("role") == "user"]
-                    prompt = ' '.join(user_msgs)
+                system_instruction, contents = _to_gemini_contents(messages)
+            
+            model = _gemini_model(self.model_name, system_instruction)
             
             # Generate content with Gemini
             response = model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=self.temperature,
-                    max_output_tokens=1500,
-                ),
-                safety_settings=[
-                    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-                    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-                    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-                    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-                ]
+                contents,
+                generation_config=self._generation_config,
+                safety_settings=self._safety_settings
             )
             
             # Check if response was blocked or empty
@@ -977,24 +1100,26 @@ if __name__ == "__main__":
     
     while True:
         user_input = input("Patient: ").strip()
+        command = user_input.lower()
         
-        if user_input.lower() == 'quit':
+        if command == 'quit':
             print("Session ended. Patient data has been saved.")
-            wandb.finish()
+            if _WANDB_ENABLED:
+                wandb.finish()
             break
         
-        if user_input.lower() == 'status':
+        if command == 'status':
             status = patient_hero.get_patient_status()
-            print(f"Current Status: {json.dumps(status, indent=2)}")
+            print(f"Current Status: {orjson.dumps(status, option=_JSON_OPTS).decode()}")
             continue
             
-        if user_input.lower() == 'extract':
+        if command == 'extract':
             print("Running data extraction on current conversation...")
             extraction_result = patient_hero._extract_structured_data()
-            print(f"Extraction Result: {json.dumps(extraction_result, indent=2)}")
+            print(f"Extraction Result: {orjson.dumps(extraction_result, option=_JSON_OPTS).decode()}")
             continue
             
-        if user_input.lower() == 'test':
+        if command == 'test':
             print("Testing Gemini API...")
             test_messages = [
                 {"role": "system", "content": "You are a helpful medical assistant."},
@@ -1035,16 +1160,3 @@ if __name__ == "__main__":
             except Exception as e:
                 print(f"Error: {e}")
                 continue
-
-    
-    def search_nearby_institutions(self, medical_condition: str, zip_code: str, insurance: str = None) -> list:
-        """Search for nearby hospitals/institutions using ExaHelper (.org/.gov only)."""
-        medical_data = {
-            "medical_condition": medical_condition,
-            "zip_code": zip_code,
-            "insurance": insurance or "",
-            "phone_suffix": "0000",
-            "session_id": self.patient_data.session_id,
-            "timestamp": datetime.now().isoformat()
-        }
-        return self.exa_helper.process_patient_from_main(medical_data)
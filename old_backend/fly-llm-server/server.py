@@ -1,12 +1,30 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import Response, StreamingResponse
 from typing import List, Optional
+import msgspec
 import uvicorn
 import os
+import json
+import uuid
 import logging
+import importlib.util
+import queue
+from threading import Thread
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
+from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig, TextIteratorStreamer
+
+# Optional vLLM backend (CUDA only): paged KV cache + continuous batching across requests
+try:
+    from vllm import AsyncEngineArgs, AsyncLLMEngine, SamplingParams
+except ImportError:
+    AsyncLLMEngine = None
+
+# Optional llama.cpp backend for CPU hosts: quantized GGUF weights with SIMD kernels
+try:
+    from llama_cpp import Llama
+except ImportError:
+    Llama = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -26,28 +44,47 @@ app.add_middleware(
 # Global variables for model and tokenizer
 tokenizer = None
 model = None
+# Set instead of model/tokenizer when INFERENCE_BACKEND=vllm
+engine = None
+# Set instead of model/tokenizer on CPU hosts when GGUF_MODEL_PATH is configured
+llama = None
+
+def is_model_loaded() -> bool:
+    """Whether the vLLM engine, the llama.cpp model or the HF model/tokenizer pair is ready."""
+    return engine is not None or llama is not None or (model is not None and tokenizer is not None)
 
-class ChatMessage(BaseModel):
+# msgspec structs: decoding and validation happen in one C-level pass over the request body
+class ChatMessage(msgspec.Struct):
     role: str  # "user", "assistant", or "system"
     content: str
 
-class ChatRequest(BaseModel):
+class ChatRequest(msgspec.Struct):
     messages: List[ChatMessage]
     max_tokens: Optional[int] = 512
     temperature: Optional[float] = 0.7
     top_p: Optional[float] = 0.9
     stream: Optional[bool] = False
 
-class ChatResponse(BaseModel):
+class ChatResponse(msgspec.Struct):
     id: str
-    object: str = "chat.completion"
-    model: str = "m42-health/Llama3-Med42-8B"
     choices: List[dict]
     usage: dict
+    object: str = "chat.completion"
+    model: str = "m42-health/Llama3-Med42-8B"
+
+def select_attn_implementation(has_cuda: bool) -> str:
+    """Use FlashAttention-2 on Ampere+ GPUs when flash-attn is installed, SDPA otherwise."""
+    if (
+        has_cuda
+        and torch.cuda.get_device_capability()[0] >= 8
+        and importlib.util.find_spec("flash_attn") is not None
+    ):
+        return "flash_attention_2"
+    return "sdpa"
 
 def load_model():
     """Load the Med42-8B model with optimizations for deployment."""
-    global tokenizer, model
+    global tokenizer, model, engine, llama
     
     model_name = "m42-health/Llama3-Med42-8B"  # Using 8B for better performance
     
@@ -57,6 +94,43 @@ def load_model():
     has_cuda = torch.cuda.is_available()
     logger.info(f"CUDA available: {has_cuda}")
     
+    # Optional pre-quantized AWQ checkpoint (requires autoawq); its int4 GEMM kernels
+    # decode faster than bitsandbytes NF4 at batch size 1
+    awq_model_name = os.getenv("AWQ_MODEL_NAME")
+    
+    if os.getenv("INFERENCE_BACKEND") == "vllm":
+        if AsyncLLMEngine is None or not has_cuda:
+            raise RuntimeError("INFERENCE_BACKEND=vllm requires the vllm package and a CUDA device")
+        logger.info("Starting vLLM engine...")
+        engine = AsyncLLMEngine.from_engine_args(AsyncEngineArgs(
+            model=awq_model_name or model_name,
+            dtype="float16",
+            quantization="awq" if awq_model_name else None,
+            max_model_len=4096,
+            download_dir="/app/cache"
+        ))
+        logger.info("Med42-8B vLLM engine started successfully!")
+        return
+    
+    # The fp32 HF path is impractically slow on CPU; prefer a quantized GGUF via llama.cpp
+    gguf_model_path = os.getenv("GGUF_MODEL_PATH")
+    if not has_cuda and gguf_model_path:
+        if Llama is None:
+            raise RuntimeError("GGUF_MODEL_PATH requires the llama-cpp-python package")
+        logger.info(f"Loading GGUF model with llama.cpp: {gguf_model_path}")
+        llama = Llama(
+            model_path=gguf_model_path,
+            n_ctx=4096,
+            n_threads=os.cpu_count(),
+            n_batch=512,
+            verbose=False
+        )
+        logger.info("Med42-8B llama.cpp model loaded successfully!")
+        return
+    
+    attn_implementation = select_attn_implementation(has_cuda)
+    logger.info(f"Attention implementation: {attn_implementation}")
+    
     try:
         # Load tokenizer
         tokenizer = AutoTokenizer.from_pretrained(
@@ -70,7 +144,17 @@ def load_model():
             tokenizer.pad_token = tokenizer.eos_token
         
         # Load model with appropriate configuration
-        if has_cuda:
+        if has_cuda and awq_model_name:
+            logger.info(f"Loading AWQ-quantized weights: {awq_model_name}")
+            model = AutoModelForCausalLM.from_pretrained(
+                awq_model_name,
+                device_map="auto",
+                trust_remote_code=True,
+                torch_dtype=torch.float16,
+                attn_implementation=attn_implementation,
+                cache_dir="/app/cache"
+            )
+        elif has_cuda:
             # Configure quantization for memory efficiency (GPU)
             quantization_config = BitsAndBytesConfig(
                 load_in_4bit=True,
@@ -85,6 +169,7 @@ def load_model():
                 device_map="auto",
                 trust_remote_code=True,
                 torch_dtype=torch.float16,
+                attn_implementation=attn_implementation,
                 cache_dir="/app/cache"
             )
         else:
@@ -94,37 +179,60 @@ def load_model():
                 model_name,
                 trust_remote_code=True,
                 torch_dtype=torch.float32,
+                attn_implementation=attn_implementation,
                 device_map="cpu",
                 cache_dir="/app/cache",
                 low_cpu_mem_usage=True
             )
         
+        # Opt-in: capture the decode step with CUDA graphs to cut per-token Python/launch overhead.
+        # Needs a static KV cache so graphs aren't re-recorded as the cache grows, and is skipped
+        # for the bitsandbytes NF4 model, whose kernels break the graph anyway
+        if has_cuda and os.getenv("TORCH_COMPILE", "0") == "1":
+            if awq_model_name:
+                logger.info("Compiling model forward with torch.compile (reduce-overhead, static KV cache)...")
+                model.generation_config.cache_implementation = "static"
+                model.forward = torch.compile(model.forward, mode="reduce-overhead", fullgraph=False)
+            else:
+                logger.info("TORCH_COMPILE ignored: the bitsandbytes 4-bit model does not compile cleanly")
+        
+        # Warm up so the first request doesn't pay for kernel selection, compilation and KV-cache allocation
+        if has_cuda:
+            logger.info("Warming up model...")
+            with torch.inference_mode():
+                warmup_inputs = tokenizer("warmup", return_tensors="pt").to("cuda")
+                model.generate(**warmup_inputs, max_new_tokens=4, pad_token_id=tokenizer.pad_token_id)
+            torch.cuda.synchronize()
+        
         logger.info("Med42-8B model loaded successfully!")
         
     except Exception as e:
         logger.error(f"Error loading model: {str(e)}")
         raise e
 
+DEFAULT_SYSTEM_MESSAGE = "You are Med42, a helpful and knowledgeable medical AI assistant. Provide accurate, evidence-based medical information while being empathetic and professional. Always remind users to consult healthcare professionals for medical advice."
+
+# Prompt label per chat role; anything other than user/system is rendered as the assistant
+ROLE_LABELS = {"user": "Human"}
+
 def format_chat_prompt(messages: List[ChatMessage]) -> str:
     """Format chat messages into a prompt suitable for Llama3-Med42-70B."""
-    system_message = "You are Med42, a helpful and knowledgeable medical AI assistant. Provide accurate, evidence-based medical information while being empathetic and professional. Always remind users to consult healthcare professionals for medical advice."
-    
-    # Find system message if provided
-    for msg in messages:
-        if msg.role == "system":
-            system_message = msg.content
-            break
-    
-    # Build conversation
-    conversation = f"System: {system_message}\n\n"
+    system_message = None
+    parts = []
     
+    # Single pass: the first system message wins, everything else becomes a turn
     for message in messages:
-        if message.role != "system":
-            role = "Human" if message.role == "user" else "Assistant"
-            conversation += f"{role}: {message.content}\n\n"
+        if message.role == "system":
+            if system_message is None:
+                system_message = message.content
+        else:
+            role = ROLE_LABELS.get(message.role, "Assistant")
+            parts.append(f"{role}: {message.content}\n\n")
     
-    conversation += "Assistant:"
-    return conversation
+    if system_message is None:
+        system_message = DEFAULT_SYSTEM_MESSAGE
+    
+    return "".join([f"System: {system_message}\n\n", *parts, "Assistant:"])
 
 @app.on_event("startup")
 async def startup_event():
@@ -139,69 +247,235 @@ async def root():
 @app.get("/health")
 async def health_check():
     """Detailed health check."""
-    global model, tokenizer
+    global model, tokenizer, engine, llama
     
-    if model is None or tokenizer is None:
+    if not is_model_loaded():
         raise HTTPException(status_code=503, detail="Model not loaded")
     
+    if engine is not None:
+        backend = "vllm"
+    elif llama is not None:
+        backend = "llama.cpp"
+    else:
+        backend = "transformers"
+    
     return {
         "status": "healthy",
-        "model_loaded": model is not None,
-        "tokenizer_loaded": tokenizer is not None,
+        "backend": backend,
+        "model_loaded": model is not None or backend != "transformers",
+        "tokenizer_loaded": tokenizer is not None or backend != "transformers",
         "gpu_available": torch.cuda.is_available(),
         "gpu_count": torch.cuda.device_count() if torch.cuda.is_available() else 0
     }
 
-@app.post("/v1/chat/completions", response_model=ChatResponse)
-async def chat_completions(request: ChatRequest):
+def vllm_sampling_params(request: ChatRequest) -> "SamplingParams":
+    """Sampling arguments for the vLLM engine, mirroring the HF path."""
+    return SamplingParams(
+        max_tokens=request.max_tokens,
+        temperature=request.temperature,
+        top_p=request.top_p,
+        repetition_penalty=1.1
+    )
+
+async def generate_with_vllm(prompt: str, request: ChatRequest):
+    """Generate with the vLLM engine; returns (text, prompt_tokens, completion_tokens)."""
+    sampling_params = vllm_sampling_params(request)
+    
+    final_output = None
+    async for output in engine.generate(prompt, sampling_params, uuid.uuid4().hex):
+        final_output = output
+    
+    completion = final_output.outputs[0]
+    return completion.text.strip(), len(final_output.prompt_token_ids), len(completion.token_ids)
+
+def llama_chat_messages(messages: List[ChatMessage]) -> List[dict]:
+    """Messages for llama.cpp, which applies the model's own chat template."""
+    chat_messages = [{"role": m.role, "content": m.content} for m in messages]
+    if not any(m["role"] == "system" for m in chat_messages):
+        chat_messages.insert(0, {"role": "system", "content": DEFAULT_SYSTEM_MESSAGE})
+    return chat_messages
+
+def llama_completion_kwargs(request: ChatRequest) -> dict:
+    """Sampling arguments for llama.cpp, mirroring the HF path."""
+    return {
+        "max_tokens": request.max_tokens,
+        "temperature": request.temperature,
+        "top_p": request.top_p,
+        "repeat_penalty": 1.1
+    }
+
+def generate_with_llama(request: ChatRequest):
+    """Generate with llama.cpp; returns (text, prompt_tokens, completion_tokens)."""
+    completion = llama.create_chat_completion(
+        messages=llama_chat_messages(request.messages),
+        **llama_completion_kwargs(request)
+    )
+    usage = completion["usage"]
+    return (
+        completion["choices"][0]["message"]["content"].strip(),
+        usage["prompt_tokens"],
+        usage["completion_tokens"]
+    )
+
+def stream_with_llama(request: ChatRequest, completion_id: str):
+    """Yield SSE chunks from llama.cpp, which already emits OpenAI-style deltas."""
+    try:
+        for chunk in llama.create_chat_completion(
+            messages=llama_chat_messages(request.messages),
+            stream=True,
+            **llama_completion_kwargs(request)
+        ):
+            chunk["id"] = completion_id
+            yield f"data: {json.dumps(chunk)}\n\n"
+    except Exception as e:
+        # Headers are already sent, so report a failure as a final chunk instead of a 500
+        logger.error(f"Error in streamed generation: {str(e)}")
+        yield sse_chunk(completion_id, finish_reason="error")
+    yield "data: [DONE]\n\n"
+
+def tokenize_prompt(prompt: str) -> dict:
+    """Tokenize a prompt and move it to the GPU if available."""
+    inputs = tokenizer(
+        prompt,
+        return_tensors="pt",
+        truncation=True,
+        max_length=4096,
+        padding=True
+    )
+    
+    # Move to GPU if available
+    if torch.cuda.is_available():
+        inputs = {k: v.cuda() for k, v in inputs.items()}
+    return inputs
+
+def generation_kwargs(request: ChatRequest) -> dict:
+    """Sampling arguments shared by the blocking and streaming HF paths."""
+    return {
+        "max_new_tokens": request.max_tokens,
+        "temperature": request.temperature,
+        "top_p": request.top_p,
+        "do_sample": True,
+        "pad_token_id": tokenizer.pad_token_id,
+        "eos_token_id": tokenizer.eos_token_id,
+        "repetition_penalty": 1.1
+    }
+
+def generate_with_transformers(prompt: str, request: ChatRequest):
+    """Generate with the HF model; returns (text, prompt_tokens, completion_tokens)."""
+    inputs = tokenize_prompt(prompt)
+    
+    # Generate response
+    with torch.inference_mode():
+        outputs = model.generate(**inputs, **generation_kwargs(request))
+    
+    # Decode response
+    generated_tokens = outputs[0][inputs['input_ids'].shape[1]:]
+    response_text = tokenizer.decode(generated_tokens, skip_special_tokens=True)
+    
+    # Clean up response and calculate token usage
+    return response_text.strip(), inputs['input_ids'].shape[1], len(generated_tokens)
+
+def sse_chunk(completion_id: str, content: Optional[str] = None, finish_reason: Optional[str] = None) -> str:
+    """Format one OpenAI-style chat.completion.chunk server-sent event."""
+    delta = {"content": content} if content is not None else {}
+    chunk = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "model": "m42-health/Llama3-Med42-8B",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }
+    return f"data: {json.dumps(chunk)}\n\n"
+
+# Seconds to wait for the next decoded text before giving up on a streamed generation
+STREAM_TOKEN_TIMEOUT = float(os.getenv("STREAM_TOKEN_TIMEOUT", 120))
+
+def stream_with_transformers(prompt: str, request: ChatRequest, completion_id: str):
+    """Run generation on a worker thread and yield SSE chunks as tokens are decoded."""
+    inputs = tokenize_prompt(prompt)
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=STREAM_TOKEN_TIMEOUT)
+    errors = []
+    
+    def generate():
+        try:
+            with torch.inference_mode():
+                model.generate(**inputs, **generation_kwargs(request), streamer=streamer)
+        except Exception as e:
+            logger.error(f"Error in streamed generation: {str(e)}")
+            errors.append(e)
+        finally:
+            # Always signal the end so the consumer below never waits on a dead thread
+            streamer.end()
+    
+    Thread(target=generate, daemon=True).start()
+    
+    # Sync generator: StreamingResponse iterates it in the threadpool, so blocking on the streamer is fine
+    try:
+        for text in streamer:
+            if text:
+                yield sse_chunk(completion_id, text)
+    except queue.Empty:
+        logger.error(f"Streamed generation produced no text for {STREAM_TOKEN_TIMEOUT}s")
+        errors.append(TimeoutError("generation timed out"))
+    
+    # Headers are already sent, so report a failure as a final chunk instead of a 500
+    yield sse_chunk(completion_id, finish_reason="error" if errors else "stop")
+    yield "data: [DONE]\n\n"
+
+async def stream_with_vllm(prompt: str, request: ChatRequest, completion_id: str):
+    """Yield SSE chunks from the vLLM engine as text is generated."""
+    sampling_params = vllm_sampling_params(request)
+    
+    sent = 0
+    finish_reason = "stop"
+    try:
+        async for output in engine.generate(prompt, sampling_params, completion_id):
+            # vLLM reports cumulative text; forward only the new suffix
+            text = output.outputs[0].text
+            if len(text) > sent:
+                yield sse_chunk(completion_id, text[sent:])
+                sent = len(text)
+    except Exception as e:
+        # Headers are already sent, so report a failure as a final chunk instead of a 500
+        logger.error(f"Error in streamed generation: {str(e)}")
+        finish_reason = "error"
+    yield sse_chunk(completion_id, finish_reason=finish_reason)
+    yield "data: [DONE]\n\n"
+
+@app.post("/v1/chat/completions")
+async def chat_completions(http_request: Request):
     """OpenAI-compatible chat completions endpoint."""
-    global model, tokenizer
+    global model, tokenizer, engine, llama
     
-    if model is None or tokenizer is None:
+    if not is_model_loaded():
         raise HTTPException(status_code=503, detail="Model not loaded")
     
+    try:
+        request = msgspec.json.decode(await http_request.body(), type=ChatRequest)
+    except (msgspec.ValidationError, msgspec.DecodeError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    
     try:
         # Format the prompt
         prompt = format_chat_prompt(request.messages)
         
-        # Tokenize input
-        inputs = tokenizer(
-            prompt,
-            return_tensors="pt",
-            truncation=True,
-            max_length=4096,
-            padding=True
-        )
+        if request.stream:
+            completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+            if engine is not None:
+                stream = stream_with_vllm(prompt, request, completion_id)
+            elif llama is not None:
+                stream = stream_with_llama(request, completion_id)
+            else:
+                stream = stream_with_transformers(prompt, request, completion_id)
+            return StreamingResponse(stream, media_type="text/event-stream")
         
-        # Move to GPU if available
-        if torch.cuda.is_available():
-            inputs = {k: v.cuda() for k, v in inputs.items()}
-        
-        # Generate response
-        with torch.no_grad():
-            outputs = model.generate(
-                **inputs,
-                max_new_tokens=request.max_tokens,
-                temperature=request.temperature,
-                top_p=request.top_p,
-                do_sample=True,
-                pad_token_id=tokenizer.pad_token_id,
-                eos_token_id=tokenizer.eos_token_id,
-                repetition_penalty=1.1
-            )
-        
-        # Decode response
-        generated_tokens = outputs[0][inputs['input_ids'].shape[1]:]
-        response_text = tokenizer.decode(generated_tokens, skip_special_tokens=True)
-        
-        # Clean up response
-        response_text = response_text.strip()
-        
-        # Calculate token usage
-        input_tokens = inputs['input_ids'].shape[1]
-        output_tokens = len(generated_tokens)
+        if engine is not None:
+            response_text, input_tokens, output_tokens = await generate_with_vllm(prompt, request)
+        elif llama is not None:
+            response_text, input_tokens, output_tokens = generate_with_llama(request)
+        else:
+            response_text, input_tokens, output_tokens = generate_with_transformers(prompt, request)
         
-        return ChatResponse(
+        response = ChatResponse(
             id=f"chatcmpl-{hash(prompt) % 1000000}",
             choices=[{
                 "index": 0,
@@ -217,6 +491,7 @@ async def chat_completions(request: ChatRequest):
                 "total_tokens": input_tokens + output_tokens
             }
         )
+        return Response(content=msgspec.json.encode(response), media_type="application/json")
         
     except Exception as e:
         logger.error(f"Error generating response: {str(e)}")
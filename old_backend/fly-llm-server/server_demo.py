@@ -1,18 +1,47 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, Response
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, ConfigDict, TypeAdapter, ValidationError
+from typing import Dict, Final, List, Optional, Tuple
+from functools import lru_cache
+import orjson
 import uvicorn
 import os
 import logging
 import hashlib
+import itertools
 import time
 
+# Optional Aho-Corasick automaton: matches every demo keyword in one pass
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Optional xxh3 hashing for static payload ETags (non-cryptographic, much cheaper than MD5)
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Optional semantic matching for phrasings the keyword lists miss (SEMANTIC_CACHE=1)
+try:
+    import faiss
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="PatientHero Med42-8B API (Demo)", version="1.0.0")
+app = FastAPI(
+    title="PatientHero Med42-8B API (Demo)",
+    version="1.0.0",
+    default_response_class=ORJSONResponse
+)
 
 # Configure CORS
 app.add_middleware(
@@ -23,11 +52,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress the markdown-heavy completion bodies
+app.add_middleware(GZipMiddleware, minimum_size=512, compresslevel=5)
+
 class ChatMessage(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True)
+    
     role: str  # "user", "assistant", or "system"
     content: str
 
 class ChatRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True)
+    
     messages: List[ChatMessage]
     max_tokens: Optional[int] = 512
     temperature: Optional[float] = 0.7
@@ -41,13 +77,11 @@ class ChatResponse(BaseModel):
     choices: List[dict]
     usage: dict
 
-def generate_medical_response(user_message: str) -> str:
-    """Generate a demo medical response based on user input."""
-    user_lower = user_message.lower()
-    
-    # Simple keyword-based responses for demo
-    if any(word in user_lower for word in ['headache', 'head', 'migraine']):
-        return """Headaches can have various causes including:
+# Request bodies are validated straight from JSON bytes by pydantic-core
+_chat_request_adapter = TypeAdapter(ChatRequest)
+
+# Canned demo responses, built once at import
+_HEADACHE_RESPONSE: Final[str] = """Headaches can have various causes including:
 
 • **Tension headaches**: Often caused by stress, dehydration, or muscle tension
 • **Dehydration**: Very common cause, especially if you haven't had enough water
@@ -66,8 +100,7 @@ def generate_medical_response(user_message: str) -> str:
 • Frequent or worsening headaches
 • Headache after head injury"""
 
-    elif any(word in user_lower for word in ['stomach', 'belly', 'gas', 'nausea', 'abdomen']):
-        return """Stomach discomfort and gas can be caused by:
+_STOMACH_RESPONSE: Final[str] = """Stomach discomfort and gas can be caused by:
 
 • **Dietary factors**: Eating too quickly, certain foods, or food intolerances
 • **Digestive issues**: Normal digestion processes or mild irritation
@@ -87,8 +120,7 @@ def generate_medical_response(user_message: str) -> str:
 • Signs of dehydration
 • Pain with fever"""
 
-    elif any(word in user_lower for word in ['fever', 'temperature', 'hot', 'chills']):
-        return """Fever is often your body's natural response to infection:
+_FEVER_RESPONSE: Final[str] = """Fever is often your body's natural response to infection:
 
 • **Common causes**: Viral or bacterial infections, inflammation
 • **Normal range**: 98.6°F (37°C) is average, but varies by person
@@ -107,8 +139,7 @@ def generate_medical_response(user_message: str) -> str:
 • Severe headache or stiff neck
 • Signs of dehydration"""
 
-    else:
-        return f"""Based on your concern about "{user_message}", here's some general health information:
+_GENERAL_RESPONSE_TEMPLATE: Final[str] = """Based on your concern about "{user_message}", here's some general health information:
 
 **Common steps for many health concerns:**
 • Monitor your symptoms and how they change
@@ -130,90 +161,248 @@ def generate_medical_response(user_message: str) -> str:
 
 If you're concerned about your symptoms, consider consulting with a healthcare provider who can properly evaluate your specific situation."""
 
+_RESPONSES: Final[Dict[str, str]] = {
+    "headache": _HEADACHE_RESPONSE,
+    "stomach": _STOMACH_RESPONSE,
+    "fever": _FEVER_RESPONSE,
+}
+
+# Approximate token counts for the canned responses
+_RESPONSE_WORDS = {category: len(text.split()) for category, text in _RESPONSES.items()}
+
+# Canned responses as JSON string literals, spliced into the completion envelope as-is
+_RESPONSE_JSON: Final[Dict[str, bytes]] = {category: orjson.dumps(text) for category, text in _RESPONSES.items()}
+_ENVELOPE_ID = b'{"id":"'
+_ENVELOPE_CONTENT = (
+    b'","object":"chat.completion","model":"m42-health/Llama3-Med42-8B",'
+    b'"choices":[{"index":0,"message":{"role":"assistant","content":'
+)
+_ENVELOPE_USAGE = b'},"finish_reason":"stop"}],"usage":'
+
+# Keyword branches in priority order; anything unmatched is "general"
+_CATEGORY_KEYWORDS = (
+    ("headache", ('headache', 'head', 'migraine')),
+    ("stomach", ('stomach', 'belly', 'gas', 'nausea', 'abdomen')),
+    ("fever", ('fever', 'temperature', 'hot', 'chills')),
+)
+
+def _build_automaton():
+    """Build an automaton mapping each keyword to its (priority, category)."""
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for priority, (category, keywords) in enumerate(_CATEGORY_KEYWORDS):
+        for word in keywords:
+            automaton.add_word(word, (priority, category))
+    automaton.make_automaton()
+    return automaton
+
+_KEYWORD_AUTOMATON = _build_automaton()
+
+@lru_cache(maxsize=2048)
+def _classify(user_lower: str) -> str:
+    """Map a normalized user message to a demo response category."""
+    if _KEYWORD_AUTOMATON is not None:
+        best = None
+        for _, (priority, category) in _KEYWORD_AUTOMATON.iter(user_lower):
+            if priority == 0:
+                return category
+            if best is None or priority < best[0]:
+                best = (priority, category)
+        return best[1] if best else "general"
+    
+    for category, keywords in _CATEGORY_KEYWORDS:
+        if any(word in user_lower for word in keywords):
+            return category
+    return "general"
+
+# Completion ids: per-process prefix plus a C-level counter (next() is atomic under the GIL)
+_ID_PREFIX = f"chatcmpl-{os.getpid():x}-"
+_ID_COUNTER = itertools.count()
+
+# Canonical queries per category for the semantic index
+_SEMANTIC_EXAMPLES = (
+    ("headache", "I have a headache"),
+    ("headache", "my head is pounding"),
+    ("headache", "I keep getting migraines"),
+    ("stomach", "my stomach hurts"),
+    ("stomach", "I feel nauseous and bloated"),
+    ("stomach", "I have cramps in my abdomen"),
+    ("fever", "I have a fever"),
+    ("fever", "I feel feverish with chills"),
+    ("fever", "my temperature is really high"),
+)
+_SEMANTIC_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.8"))
+
+# Populated at startup when SEMANTIC_CACHE=1
+semantic_model = None
+semantic_index = None
+
+def load_semantic_index():
+    """Embed the canonical queries into an inner-product FAISS index."""
+    global semantic_model, semantic_index
+    
+    if os.getenv("SEMANTIC_CACHE", "0") != "1":
+        return
+    if SentenceTransformer is None:
+        logger.warning("SEMANTIC_CACHE=1 but sentence-transformers/faiss are not installed; using keywords only")
+        return
+    
+    model_name = os.getenv("SEMANTIC_CACHE_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+    logger.info(f"Loading semantic cache model {model_name}")
+    semantic_model = SentenceTransformer(model_name)
+    
+    vectors = semantic_model.encode([text for _, text in _SEMANTIC_EXAMPLES], normalize_embeddings=True)
+    semantic_index = faiss.IndexFlatIP(vectors.shape[1])
+    semantic_index.add(vectors)
+
+@lru_cache(maxsize=2048)
+def _semantic_classify(user_lower: str) -> str:
+    """Match a message the keywords missed against the canonical queries."""
+    vector = semantic_model.encode([user_lower], normalize_embeddings=True)
+    scores, ids = semantic_index.search(vector, 1)
+    if scores[0][0] >= _SEMANTIC_THRESHOLD:
+        return _SEMANTIC_EXAMPLES[ids[0][0]][0]
+    return "general"
+
+def _render_response(category: str, user_message: str) -> str:
+    """Build the demo response text for a classified message."""
+    if category == "general":
+        return _GENERAL_RESPONSE_TEMPLATE.format(user_message=user_message)
+    return _RESPONSES[category]
+
+@app.on_event("startup")
+async def startup_event():
+    """Build the optional semantic index when the server starts."""
+    load_semantic_index()
+
+def _static_json(payload: dict) -> Tuple[bytes, str]:
+    """Pre-serialize a constant payload and derive its ETag."""
+    body = orjson.dumps(payload)
+    digest = xxhash.xxh3_64_hexdigest(body) if xxhash is not None else hashlib.md5(body).hexdigest()
+    return body, f'"{digest}"'
+
+def _static_response(request: Request, body: bytes, etag: str) -> Response:
+    """Serve a pre-serialized payload, or 304 if the client already has it."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
+_ROOT_BODY, _ROOT_ETAG = _static_json({
+    "message": "PatientHero Med42-8B API (Demo Mode)",
+    "model": "m42-health/Llama3-Med42-8B",
+    "status": "running",
+    "mode": "demo"
+})
+
 @app.get("/")
-async def root():
+async def root(request: Request):
     """Health check endpoint."""
-    return {
-        "message": "PatientHero Med42-8B API (Demo Mode)",
-        "model": "m42-health/Llama3-Med42-8B",
-        "status": "running",
-        "mode": "demo"
-    }
+    return _static_response(request, _ROOT_BODY, _ROOT_ETAG)
+
+_HEALTH_BODY, _HEALTH_ETAG = _static_json({
+    "status": "healthy",
+    "model": "m42-health/Llama3-Med42-8B",
+    "mode": "demo",
+    "version": "1.0.0"
+})
 
 @app.get("/health")
-async def health_check():
+async def health_check(request: Request):
     """Detailed health check."""
-    return {
-        "status": "healthy",
-        "model": "m42-health/Llama3-Med42-8B",
-        "mode": "demo",
-        "version": "1.0.0"
-    }
-
-@app.post("/v1/chat/completions", response_model=ChatResponse)
-async def chat_completions(request: ChatRequest):
+    return _static_response(request, _HEALTH_BODY, _HEALTH_ETAG)
+
+# ChatResponse documents the schema only; the handler assembles the JSON bytes itself
+@app.post("/v1/chat/completions", responses={200: {"model": ChatResponse}})
+async def chat_completions(http_request: Request):
     """OpenAI-compatible chat completions endpoint."""
     try:
-        # Get the last user message
+        request = _chat_request_adapter.validate_json(await http_request.body())
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_input=False))
+    
+    try:
+        # Get the last user message (clients almost always send it last)
+        messages = request.messages
         user_message = ""
-        for msg in reversed(request.messages):
-            if msg.role == "user":
-                user_message = msg.content
-                break
+        if messages and messages[-1].role == "user":
+            user_message = messages[-1].content
+        else:
+            for i in range(len(messages) - 2, -1, -1):
+                if messages[i].role == "user":
+                    user_message = messages[i].content
+                    break
         
         if not user_message:
             user_message = "general health question"
         
         # Generate medical response
-        response_text = generate_medical_response(user_message)
+        user_lower = user_message.lower().strip()
+        category = _classify(user_lower)
+        if category == "general" and semantic_index is not None:
+            # Embedding is CPU-bound; keep it off the event loop
+            category = await run_in_threadpool(_semantic_classify, user_lower)
+        content_json = _RESPONSE_JSON.get(category)
+        if content_json is None:
+            response_text = _render_response(category, user_message)
+            content_json = orjson.dumps(response_text)
+            output_tokens = len(response_text.split())
+        else:
+            output_tokens = _RESPONSE_WORDS[category]
         
         # Calculate token usage (approximate)
         input_tokens = sum(len(msg.content.split()) for msg in request.messages)
-        output_tokens = len(response_text.split())
         
-        return ChatResponse(
-            id=f"chatcmpl-{hashlib.md5(user_message.encode()).hexdigest()[:8]}",
-            choices=[{
-                "index": 0,
-                "message": {
-                    "role": "assistant",
-                    "content": response_text
-                },
-                "finish_reason": "stop"
-            }],
-            usage={
-                "prompt_tokens": input_tokens,
-                "completion_tokens": output_tokens,
-                "total_tokens": input_tokens + output_tokens
-            }
-        )
+        usage = {
+            "prompt_tokens": input_tokens,
+            "completion_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens
+        }
+        body = b"".join((
+            _ENVELOPE_ID,
+            f"{_ID_PREFIX}{next(_ID_COUNTER):x}".encode(),
+            _ENVELOPE_CONTENT,
+            content_json,
+            _ENVELOPE_USAGE,
+            orjson.dumps(usage),
+            b"}"
+        ))
+        return Response(body, media_type="application/json")
         
     except Exception as e:
         logger.error(f"Error generating response: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error generating response: {str(e)}")
 
+_MODELS_BODY, _MODELS_ETAG = _static_json({
+    "object": "list",
+    "data": [
+        {
+            "id": "m42-health/Llama3-Med42-8B",
+            "object": "model",
+            "created": 1699564800,
+            "owned_by": "m42-health",
+            "permission": [],
+            "root": "m42-health/Llama3-Med42-8B",
+            "parent": None
+        }
+    ]
+})
+
 @app.get("/v1/models")
-async def list_models():
+async def list_models(request: Request):
     """List available models (OpenAI-compatible)."""
-    return {
-        "object": "list",
-        "data": [
-            {
-                "id": "m42-health/Llama3-Med42-8B",
-                "object": "model",
-                "created": 1699564800,
-                "owned_by": "m42-health",
-                "permission": [],
-                "root": "m42-health/Llama3-Med42-8B",
-                "parent": None
-            }
-        ]
-    }
+    return _static_response(request, _MODELS_BODY, _MODELS_ETAG)
 
 if __name__ == "__main__":
     uvicorn.run(
         "server_demo:app",
         host="0.0.0.0",
         port=int(os.getenv("PORT", 8000)),
-        workers=1
+        # uvloop/httptools ship with uvicorn[standard]; the demo handlers are stateless so workers scale freely
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 2)),
+        loop="uvloop",
+        http="httptools",
+        limit_concurrency=1000,
+        timeout_keep_alive=30
     )
@@ -4,11 +4,70 @@ Prompt Management Utility for PatientHero
 Loads and manages system prompts from prompt.json
 """
 
-import json
 import os
+import re
+from functools import lru_cache
 from typing import Dict, List, Optional
 from pathlib import Path
 
+import orjson
+
+# Optional Aho-Corasick automaton: classifies against every keyword set in one pass
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Keyword categories in the order generate_response checks them
+_CATEGORY_PRIORITY = ("emergency", "greeting", "test", "medical")
+
+# Optional RE2 engine for the concise rewrites: linear-time matching with no backtracking
+try:
+    import re2 as _concise_re
+except ImportError:
+    _concise_re = re
+
+# Verbose disclaimer patterns, removed together in one pass
+_VERBOSE_PATTERNS = (
+    r'This information is for educational purposes only and does not constitute medical advice\.',
+    r'Always consult with healthcare professionals for medical concerns\.',
+    r'I provide educational information only and cannot replace professional medical advice\.',
+    r'For any health concerns, please consult with qualified healthcare providers\.',
+    r'<thinking>.*?</thinking>',  # Remove thinking blocks
+    r'As a medical AI assistant powered by [^,]+,',  # Remove model references
+    r'Thank you for your (medical )?question about:',  # Remove thank you phrases
+    r'\*This is educational information only[^*]*\*',  # Remove disclaimer lines
+    r'\*Note:[^*]*\*',  # Remove note disclaimers
+)
+
+# make_response_concise rewrites, applied in order
+_CONCISE_PATTERNS = (
+    # Remove excessive markdown formatting
+    (_concise_re.compile(r'\*\*([^*]+)\*\*'), r'\1'),  # Remove bold formatting
+    (_concise_re.compile(r'\*([^*]+)\*'), r'\1'),      # Remove italic formatting
+    # Remove verbose disclaimer patterns
+    (_concise_re.compile('(?is)' + '|'.join(_VERBOSE_PATTERNS)), ''),
+    # Clean up extra whitespace and newlines
+    (_concise_re.compile(r'\n\s*\n\s*\n'), '\n\n'),  # Max 2 consecutive newlines
+    (_concise_re.compile(r'^\s+|\s+$'), ''),          # Trim whitespace
+)
+
+def make_response_concise(response: str) -> str:
+    """Strip excessive formatting and verbose disclaimers from a response"""
+    for pattern, replacement in _CONCISE_PATTERNS:
+        response = pattern.sub(replacement, response)
+    return response
+
+@lru_cache(maxsize=None)
+def _read_prompt_file(prompt_file_path: Path) -> Dict:
+    """Parse a prompt file once per path; instances share the result read-only"""
+    try:
+        return orjson.loads(prompt_file_path.read_bytes())
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Prompt file not found: {prompt_file_path}")
+    except orjson.JSONDecodeError as e:
+        raise ValueError(f"Invalid JSON in prompt file: {e}")
+
 class PromptManager:
     """Manages system prompts and response templates for PatientHero"""
     
@@ -21,25 +80,25 @@ class PromptManager:
         
         self.prompt_file_path = Path(prompt_file_path)
         self.prompts_data = self._load_prompts()
+        self._system_prompts = self.prompts_data.get("system_prompts", {})
+        self._demo_responses = self.prompts_data.get("demo_responses", {})
+        self._safety_keywords = self.prompts_data.get("safety_keywords", {})
+        self._disclaimers = self.prompts_data.get("disclaimers", {})
+        # Compiled keyword alternations, built lazily per keyword type
+        self._kw_regex: Dict[str, re.Pattern] = {}
+        self._automaton = self._build_automaton()
     
     def _load_prompts(self) -> Dict:
         """Load prompts from JSON file"""
-        try:
-            with open(self.prompt_file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            raise FileNotFoundError(f"Prompt file not found: {self.prompt_file_path}")
-        except json.JSONDecodeError as e:
-            raise ValueError(f"Invalid JSON in prompt file: {e}")
+        return _read_prompt_file(self.prompt_file_path.resolve())
     
     def get_system_prompt(self, model_name: str = "deepseek_r1_medical") -> str:
         """Get system prompt for specified model"""
-        system_prompts = self.prompts_data.get("system_prompts", {})
-        prompt_config = system_prompts.get(model_name)
+        prompt_config = self._system_prompts.get(model_name)
         
         if not prompt_config:
             # Fallback to general medical prompt
-            prompt_config = system_prompts.get("general_medical_fallback")
+            prompt_config = self._system_prompts.get("general_medical_fallback")
             if not prompt_config:
                 raise ValueError(f"No system prompt found for model: {model_name}")
         
@@ -47,14 +106,12 @@ class PromptManager:
     
     def get_safety_guidelines(self, model_name: str = "deepseek_r1_medical") -> List[str]:
         """Get safety guidelines for specified model"""
-        system_prompts = self.prompts_data.get("system_prompts", {})
-        prompt_config = system_prompts.get(model_name, {})
+        prompt_config = self._system_prompts.get(model_name, {})
         return prompt_config.get("safety_guidelines", [])
     
     def get_demo_response(self, response_type: str, **kwargs) -> str:
         """Get demo response template with formatting"""
-        demo_responses = self.prompts_data.get("demo_responses", {})
-        response_config = demo_responses.get(response_type)
+        response_config = self._demo_responses.get(response_type)
         
         if not response_config:
             return f"Demo response type '{response_type}' not found."
@@ -70,56 +127,86 @@ class PromptManager:
     
     def get_keywords(self, keyword_type: str) -> List[str]:
         """Get keywords for specified type (medical, greeting, test, emergency)"""
-        safety_keywords = self.prompts_data.get("safety_keywords", {})
-        return safety_keywords.get(f"{keyword_type}_keywords", [])
+        return self._safety_keywords.get(f"{keyword_type}_keywords", [])
+    
+    def _keyword_regex(self, keyword_type: str) -> re.Pattern:
+        """Get a compiled regex matching any keyword of the given type in lowercased text"""
+        pattern = self._kw_regex.get(keyword_type)
+        if pattern is None:
+            keywords = [keyword.lower() for keyword in self.get_keywords(keyword_type)]
+            # An empty alternation would match everything, so fall back to a never-matching pattern
+            source = "|".join(map(re.escape, keywords)) if keywords else r"(?!)"
+            pattern = self._kw_regex[keyword_type] = re.compile(source)
+        return pattern
     
     def get_disclaimer(self, disclaimer_type: str = "standard") -> str:
         """Get disclaimer text"""
-        disclaimers = self.prompts_data.get("disclaimers", {})
-        return disclaimers.get(disclaimer_type, disclaimers.get("standard", ""))
+        return self._disclaimers.get(disclaimer_type, self._disclaimers.get("standard", ""))
+    
+    def _build_automaton(self):
+        """Build an Aho-Corasick automaton mapping each keyword to its categories"""
+        if ahocorasick is None:
+            return None
+        automaton = ahocorasick.Automaton()
+        for keyword_type in _CATEGORY_PRIORITY:
+            for keyword in self.get_keywords(keyword_type):
+                keyword = keyword.lower()
+                automaton.add_word(keyword, automaton.get(keyword, ()) + (keyword_type,))
+        if len(automaton) == 0:
+            return None
+        automaton.make_automaton()
+        return automaton
+    
+    def classify(self, user_message: str) -> Optional[str]:
+        """Get the highest-priority keyword category matched by the message, if any"""
+        user_message_lower = user_message.lower()
+        if self._automaton is None:
+            for keyword_type in _CATEGORY_PRIORITY:
+                if self._keyword_regex(keyword_type).search(user_message_lower):
+                    return keyword_type
+            return None
+        
+        matched = set()
+        for _, categories in self._automaton.iter(user_message_lower):
+            if "emergency" in categories:
+                return "emergency"
+            matched.update(categories)
+        return next((kt for kt in _CATEGORY_PRIORITY if kt in matched), None)
     
     def is_medical_query(self, user_message: str) -> bool:
         """Check if user message contains medical keywords"""
-        medical_keywords = self.get_keywords("medical")
-        user_message_lower = user_message.lower()
-        return any(keyword in user_message_lower for keyword in medical_keywords)
+        return bool(self._keyword_regex("medical").search(user_message.lower()))
     
     def is_greeting(self, user_message: str) -> bool:
         """Check if user message is a greeting"""
-        greeting_keywords = self.get_keywords("greeting")
-        user_message_lower = user_message.lower().strip()
-        return any(greeting in user_message_lower for greeting in greeting_keywords)
+        return bool(self._keyword_regex("greeting").search(user_message.lower()))
     
     def is_test_message(self, user_message: str) -> bool:
         """Check if user message is a test"""
-        test_keywords = self.get_keywords("test")
-        user_message_lower = user_message.lower()
-        return any(keyword in user_message_lower for keyword in test_keywords)
+        return bool(self._keyword_regex("test").search(user_message.lower()))
     
     def is_emergency(self, user_message: str) -> bool:
         """Check if user message indicates emergency"""
-        emergency_keywords = self.get_keywords("emergency")
-        user_message_lower = user_message.lower()
-        return any(keyword in user_message_lower for keyword in emergency_keywords)
+        return bool(self._keyword_regex("emergency").search(user_message.lower()))
     
     def generate_response(self, user_message: str, model_name: str = "Llama 3.3 70B") -> str:
         """Generate appropriate response based on user message"""
-        user_message_lower = user_message.lower().strip()
+        category = self.classify(user_message)
         
         # Check for emergency first
-        if self.is_emergency(user_message):
+        if category == "emergency":
             return "🚨 MEDICAL EMERGENCY DETECTED\n\nCall 911 or go to your nearest emergency room immediately. This AI cannot provide emergency medical care."
         
         # Check for greetings
-        if self.is_greeting(user_message):
+        if category == "greeting":
             return self.get_demo_response("greeting")
         
         # Check for test messages
-        if self.is_test_message(user_message):
+        if category == "test":
             return self.get_demo_response("test")
         
         # Check if it's specifically a medical query
-        if self.is_medical_query(user_message):
+        if category == "medical":
             response = self.get_demo_response("medical_question", user_message=user_message)
             return self.make_response_concise(response)
         
@@ -128,13 +215,11 @@ class PromptManager:
     
     def get_model_info(self, model_name: str) -> Dict:
         """Get full model configuration"""
-        system_prompts = self.prompts_data.get("system_prompts", {})
-        return system_prompts.get(model_name, {})
+        return self._system_prompts.get(model_name, {})
     
     def list_available_models(self) -> List[str]:
         """List all available model prompts"""
-        system_prompts = self.prompts_data.get("system_prompts", {})
-        return list(system_prompts.keys())
+        return list(self._system_prompts.keys())
     
     def get_metadata(self) -> Dict:
         """Get prompt file metadata"""
@@ -142,44 +227,15 @@ class PromptManager:
     
     def make_response_concise(self, response: str) -> str:
         """Make a response more concise by removing excessive formatting and verbose text"""
-        import re
-        
-        # Remove excessive markdown formatting
-        response = re.sub(r'\*\*([^*]+)\*\*', r'\1', response)  # Remove bold formatting
-        response = re.sub(r'\*([^*]+)\*', r'\1', response)     # Remove italic formatting
-        
-        # Remove verbose disclaimer patterns
-        verbose_patterns = [
-            r'This information is for educational purposes only and does not constitute medical advice\.',
-            r'Always consult with healthcare professionals for medical concerns\.',
-            r'I provide educational information only and cannot replace professional medical advice\.',
-            r'For any health concerns, please consult with qualified healthcare providers\.',
-            r'<thinking>.*?</thinking>',  # Remove thinking blocks
-            r'As a medical AI assistant powered by [^,]+,',  # Remove model references
-            r'Thank you for your (medical )?question about:',  # Remove thank you phrases
-            r'\*This is educational information only[^*]*\*',  # Remove disclaimer lines
-            r'\*Note:[^*]*\*',  # Remove note disclaimers
-        ]
-        
-        for pattern in verbose_patterns:
-            response = re.sub(pattern, '', response, flags=re.IGNORECASE | re.DOTALL)
-        
-        # Clean up extra whitespace and newlines
-        response = re.sub(r'\n\s*\n\s*\n', '\n\n', response)  # Max 2 consecutive newlines
-        response = re.sub(r'^\s+|\s+$', '', response)         # Trim whitespace
-        
-        return response
+        return make_response_concise(response)
     
     # ...existing code...
-# Global instance for easy access
-_prompt_manager = None
-
+# Global instance for easy access, built on first use; two threads racing on the very first
+# call may each build one, which is harmless since construction only reads the prompt files
+@lru_cache(maxsize=1)
 def get_prompt_manager() -> PromptManager:
     """Get global prompt manager instance"""
-    global _prompt_manager
-    if _prompt_manager is None:
-        _prompt_manager = PromptManager()
-    return _prompt_manager
+    return PromptManager()
 
 # Convenience functions
 def get_system_prompt(model_name: str = "deepseek_r1_medical") -> str:
@@ -6,21 +6,31 @@ Healthcare-focused AI chatbot backend using Fly.io AI models
 
 import os
 import asyncio
+import hashlib
+import time
 import logging
-from typing import List, Dict, Any, Optional
+from collections import OrderedDict
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple
 from dataclasses import dataclass
-from fastapi import FastAPI, HTTPException
+from fastapi import BackgroundTasks, FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
-import requests
+import httpx
 import uvicorn
 # --- New imports for monitoring and PII protection ---
 import wandb
 import weave
 import re
-import json
+import orjson
 # Note: Using regex-based PII detection for simplicity
 
+# Optional Aho-Corasick automaton for single-pass keyword blocklists
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
 # Load environment variables from .env file
 from dotenv import load_dotenv
 load_dotenv()
@@ -31,83 +41,110 @@ from prompt_manager import get_prompt_manager, generate_demo_response
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Global conversation cache
-conversation_cache: Dict[str, List[Dict[str, str]]] = {}
+# Global conversation cache: LRU over conversation ids, each holding the last 10 messages.
+# The cache is per worker process, so with WORKERS > 1 a follow-up message only sees
+# its history when it lands on the same worker; move it to a shared store (e.g. Redis) if that matters.
+MAX_CACHED_CONVERSATIONS = 1000
+MAX_CACHED_MESSAGES = 10
+conversation_cache: "OrderedDict[str, List[Dict[str, str]]]" = OrderedDict()
 
-# Regex patterns for PII detection
+# Regex patterns for PII detection, compiled once at import
 PII_PATTERNS = {
-    'email': r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b',
-    'phone': r'\b(?:\+?1[-.\s]?)?\(?([0-9]{3})\)?[-.\s]?([0-9]{3})[-.\s]?([0-9]{4})\b',
-    'ssn': r'\b\d{3}-?\d{2}-?\d{4}\b',
-    'credit_card': r'\b(?:\d{4}[-\s]?){3}\d{4}\b',
-    'zip_code': r'\b\d{5}(?:-\d{4})?\b'
+    'email': re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'),
+    'phone': re.compile(r'(\(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4}|\d{10})'),
+    'ssn': re.compile(r'\b\d{3}-\d{2}-\d{4}\b'),
+    'credit_card': re.compile(r'\b\d{4}[-\s]?\d{4}[-\s]?\d{4}[-\s]?\d{4}\b')
 }
 
-def has_pii(text: str) -> bool:
-    """Check if text contains PII using regex patterns."""
-    for pattern_name, pattern in PII_PATTERNS.items():
-        if re.search(pattern, text, re.IGNORECASE):
-            return True
-    return False
+# Redaction placeholder per PII type
+PII_REDACTIONS = {
+    'email': '[EMAIL_REDACTED]',
+    'phone': '[PHONE_REDACTED]',
+    'ssn': '[SSN_REDACTED]',
+    'credit_card': '[CC_REDACTED]'
+}
 
-def redact_pii(text: str) -> str:
-    """Redact PII from text using regex patterns."""
-    redacted_text = text
-    
-    # Redact email addresses
-    redacted_text = re.sub(PII_PATTERNS['email'], '[EMAIL_REDACTED]', redacted_text, flags=re.IGNORECASE)
-    
-    # Redact phone numbers
-    redacted_text = re.sub(PII_PATTERNS['phone'], '[PHONE_REDACTED]', redacted_text)
-    
-    # Redact SSNs
-    redacted_text = re.sub(PII_PATTERNS['ssn'], '[SSN_REDACTED]', redacted_text)
-    
-    # Redact credit card numbers
-    redacted_text = re.sub(PII_PATTERNS['credit_card'], '[CREDIT_CARD_REDACTED]', redacted_text)
-    
-    # Redact zip codes
-    redacted_text = re.sub(PII_PATTERNS['zip_code'], '[ZIP_CODE_REDACTED]', redacted_text)
-    
-    return redacted_text
+# All PII patterns fused into one alternation so detection and redaction scan the text once;
+# alternatives keep the order the patterns used to be applied in
+_PII_COMBINED = re.compile('|'.join(f'(?P<{name}>{pattern.pattern})' for name, pattern in PII_PATTERNS.items()))
 
-# Fallback PII detection functions (since wandb.pii may not be available)
 def has_pii(text: str) -> bool:
-    """Simple PII detection using regex patterns."""
-    # Email pattern
-    email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-    # Phone pattern (various formats)
-    phone_pattern = r'(\(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4}|\d{10})'
-    # SSN pattern
-    ssn_pattern = r'\b\d{3}-\d{2}-\d{4}\b'
-    # Credit card pattern (basic)
-    cc_pattern = r'\b\d{4}[-\s]?\d{4}[-\s]?\d{4}[-\s]?\d{4}\b'
-    
-    patterns = [email_pattern, phone_pattern, ssn_pattern, cc_pattern]
-    
-    for pattern in patterns:
-        if re.search(pattern, text):
-            return True
-    return False
+    """Check if text contains PII using regex patterns."""
+    return _PII_COMBINED.search(text) is not None
 
 def redact_pii(text: str) -> str:
     """Redact PII from text using regex patterns."""
-    # Email redaction
-    text = re.sub(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', '[EMAIL_REDACTED]', text)
-    # Phone redaction
-    text = re.sub(r'(\(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4}|\d{10})', '[PHONE_REDACTED]', text)
-    # SSN redaction
-    text = re.sub(r'\b\d{3}-\d{2}-\d{4}\b', '[SSN_REDACTED]', text)
-    # Credit card redaction
-    text = re.sub(r'\b\d{4}[-\s]?\d{4}[-\s]?\d{4}[-\s]?\d{4}\b', '[CC_REDACTED]', text)
-    
-    return text
+    return _PII_COMBINED.sub(lambda match: PII_REDACTIONS[match.lastgroup], text)
+
+# Streamed replies are redacted up to a whitespace boundary at least this many characters
+# behind the newest text: longer than any phone, SSN or card match and any injection phrase,
+# and emails never contain whitespace, so neither can straddle what has been sent and what is held back
+STREAM_REDACT_HOLDBACK = 32
+
+def split_redacted_prefix(buffer: str) -> Tuple[str, str]:
+    """Split buffered streamed text into a redacted prefix that is safe to send and the raw tail to hold back."""
+    cutoff = 0
+    for i in range(len(buffer) - STREAM_REDACT_HOLDBACK - 1, -1, -1):
+        if buffer[i].isspace():
+            cutoff = i + 1
+            break
+    if not cutoff:
+        return "", buffer
+
+    pieces = []
+    position = 0
+    for match in _PII_COMBINED.finditer(buffer):
+        if match.start() >= cutoff:
+            break
+        if match.end() > cutoff:
+            # Phone and card numbers may contain spaces; hold the whole match back
+            cutoff = match.start()
+            break
+        pieces.append(buffer[position:match.start()])
+        pieces.append(PII_REDACTIONS[match.lastgroup])
+        position = match.end()
+    pieces.append(buffer[position:cutoff])
+    return "".join(pieces), buffer[cutoff:]
+
+def _build_automaton(keywords) -> Optional[Any]:
+    """Compile keywords into an Aho-Corasick automaton, if the extension is installed."""
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for keyword in keywords:
+        automaton.add_word(keyword, keyword)
+    automaton.make_automaton()
+    return automaton
+
+def _contains_any(text: str, keywords, automaton) -> bool:
+    """Check whether text contains any keyword, using the automaton when available."""
+    if automaton is not None:
+        return next(automaton.iter(text), None) is not None
+    return any(keyword in text for keyword in keywords)
+
+# Keyword sets for the simulated intake flow, matched against lowercased text
+EMERGENCY_KEYWORDS = ("emergency", "urgent", "911", "chest pain", "heart attack", "can't breathe", "severe pain")
+GREETING_KEYWORDS = ("hi", "hello", "hey", "good morning", "good afternoon")
+MENTIONED_SYMPTOM_KEYWORDS = ("headache", "pain", "fever", "sick", "hurt", "symptom")
+ONSET_KEYWORDS = ("started", "from", "since", "morning", "yesterday", "today", "hours", "days", "weeks", "ago", "this", "last")
+INSURANCE_KEYWORDS = ("blue cross", "aetna", "medicare", "medicaid", "uninsured", "no insurance", "cigna", "humana")
+CONTACT_KEYWORDS = ("@", "phone", "email", "-", "(")
+NEW_SYMPTOM_KEYWORDS = ("headache", "pain", "fever", "sick", "hurt", "nausea", "dizzy", "cough", "sore throat", "ache")
+
+EMERGENCY_AC = _build_automaton(EMERGENCY_KEYWORDS)
+GREETING_AC = _build_automaton(GREETING_KEYWORDS)
+MENTIONED_SYMPTOM_AC = _build_automaton(MENTIONED_SYMPTOM_KEYWORDS)
+ONSET_AC = _build_automaton(ONSET_KEYWORDS)
+INSURANCE_AC = _build_automaton(INSURANCE_KEYWORDS)
+CONTACT_AC = _build_automaton(CONTACT_KEYWORDS)
+NEW_SYMPTOM_AC = _build_automaton(NEW_SYMPTOM_KEYWORDS)
 
 # Initialize FastAPI app
 app = FastAPI(
     title="PatientHero - DeepSeek R1 Medical AI",
     description="Healthcare chatbot powered by DeepSeek R1 on Weights & Biases",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Configure CORS
@@ -146,6 +183,7 @@ class DeepSeekConfig:
     wandb_project: str = "patienthero-llama"
     model_name: str = "meta-llama/Llama-3.3-70B-Instruct"
     base_url: str = "https://api.wandb.ai/v1"
+    remote_inference: bool = False
 
 class DeepSeekR1Service:
     """Service class for Llama 3.3 70B inference on W&B"""
@@ -191,28 +229,10 @@ class DeepSeekR1Service:
             When users ask about health topics, provide helpful information and suggest consulting healthcare professionals for medical advice. 
             For general conversation, greetings, or non-medical topics, respond normally and conversationally."""
 
-    async def chat_completion(self, messages: List[ChatMessage], **kwargs) -> str:
+    async def chat_completion(self, messages: List[Dict[str, str]], **kwargs) -> str:
         """Generate chat completion using DeepSeek R1 via W&B"""
         try:
-            # Redact PII from user messages before sending to LLM
-            redacted_messages = []
-            for msg in messages:
-                if msg.role == "user":
-                    redacted_content = redact_pii(msg.content)
-                else:
-                    redacted_content = msg.content
-                redacted_messages.append(ChatMessage(role=msg.role, content=redacted_content))
-
-            # Prepare messages with medical system prompt
-            formatted_messages = self._format_messages(redacted_messages)
-            
-            # Log the conversation to W&B
-            if self.wandb_run:
-                wandb.log({
-                    "conversation_length": len(formatted_messages),
-                    "user_message": formatted_messages[-1]["content"] if formatted_messages else "",
-                    "model": self.config.model_name
-                })
+            formatted_messages = self._prepare_messages(messages)
             
             # Use W&B inference API
             response = await self._call_wandb_inference(formatted_messages, **kwargs)
@@ -223,49 +243,99 @@ class DeepSeekR1Service:
             logger.error(f"Error in chat completion: {e}")
             raise
     
-    def _format_messages(self, messages: List[ChatMessage]) -> List[Dict[str, str]]:
-        """Format messages for DeepSeek R1"""
-        formatted = []
+    async def stream_chat_completion(self, messages: List[Dict[str, str]], **kwargs) -> AsyncIterator[str]:
+        """Stream chat completion content chunks from DeepSeek R1 via W&B"""
+        formatted_messages = self._prepare_messages(messages)
         
-        # Add system message if not present
-        has_system = any(msg.role == "system" for msg in messages)
-        if not has_system:
-            formatted.append({
-                "role": "system",
-                "content": self.get_medical_system_prompt()
-            })
+        http = getattr(app.state, "http", None)
+        if not self.config.remote_inference or http is None:
+            # The simulated response arrives all at once
+            yield await self._simulate_deepseek_response(formatted_messages)
+            return
         
-        # Add user messages
-        for msg in messages:
-            formatted.append({
-                "role": msg.role,
-                "content": msg.content
+        url, headers, payload = self._inference_request(formatted_messages, **kwargs)
+        payload["stream"] = True
+        async with http.stream("POST", url, headers=headers, content=orjson.dumps(payload)) as resp:
+            resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                data = line[len("data: "):]
+                if data == "[DONE]":
+                    break
+                content = orjson.loads(data)["choices"][0].get("delta", {}).get("content")
+                if content:
+                    yield content
+    
+    def _prepare_messages(self, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Redact PII, add the system prompt and log the conversation"""
+        # Redact PII from user messages before sending to LLM
+        redacted_messages = [
+            {"role": "user", "content": redact_pii(msg["content"])} if msg["role"] == "user" else msg
+            for msg in messages
+        ]
+
+        # Prepare messages with medical system prompt
+        formatted_messages = self._format_messages(redacted_messages)
+        
+        # Log the conversation to W&B off the event loop; the response doesn't wait on it
+        if self.wandb_run:
+            asyncio.get_running_loop().run_in_executor(None, self._log_to_wandb, {
+                "conversation_length": len(formatted_messages),
+                "user_message": formatted_messages[-1]["content"] if formatted_messages else "",
+                "model": self.config.model_name
             })
         
-        return formatted
+        return formatted_messages
+    
+    def _log_to_wandb(self, payload: Dict[str, Any]):
+        """Log a payload to W&B from a worker thread"""
+        try:
+            wandb.log(payload)
+        except Exception as e:
+            logger.warning(f"Failed to log to W&B: {e}")
+    
+    def _format_messages(self, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Format messages for DeepSeek R1"""
+        # Add system message if not present
+        has_system = any(msg["role"] == "system" for msg in messages)
+        if has_system:
+            return list(messages)
+        
+        return [{"role": "system", "content": self.get_medical_system_prompt()}, *messages]
+    
+    def _inference_request(self, messages: List[Dict[str, str]], **kwargs):
+        """Build the URL, headers and payload for the W&B inference API"""
+        # W&B inference endpoint (this is a placeholder - adjust based on actual W&B API)
+        url = f"{self.config.base_url}/inference"
+        
+        headers = {
+            "Authorization": f"Bearer {self.config.wandb_api_key}",
+            "Content-Type": "application/json"
+        }
+        
+        payload = {
+            "model": self.config.model_name,
+            "messages": messages,
+            "max_tokens": kwargs.get("max_tokens", 512),
+            "temperature": kwargs.get("temperature", 0.7),
+            "top_p": kwargs.get("top_p", 0.9)
+        }
+        return url, headers, payload
     
     async def _call_wandb_inference(self, messages: List[Dict[str, str]], **kwargs) -> str:
         """Call W&B inference API for DeepSeek R1"""
         try:
-            # W&B inference endpoint (this is a placeholder - adjust based on actual W&B API)
-            url = f"{self.config.base_url}/inference"
-            
-            headers = {
-                "Authorization": f"Bearer {self.config.wandb_api_key}",
-                "Content-Type": "application/json"
-            }
+            # Simulate a medical response unless remote inference is enabled
+            http = getattr(app.state, "http", None)
+            if not self.config.remote_inference or http is None:
+                return await self._simulate_deepseek_response(messages)
             
-            payload = {
-                "model": self.config.model_name,
-                "messages": messages,
-                "max_tokens": kwargs.get("max_tokens", 512),
-                "temperature": kwargs.get("temperature", 0.7),
-                "top_p": kwargs.get("top_p", 0.9)
-            }
-            
-            # For now, simulate a medical response (replace with actual W&B API call)
-            response = await self._simulate_deepseek_response(messages)
-            return response
+            # Shared pooled client, so concurrent requests reuse keep-alive connections
+            url, headers, payload = self._inference_request(messages, **kwargs)
+            resp = await http.post(url, headers=headers, content=orjson.dumps(payload))
+            resp.raise_for_status()
+            return orjson.loads(resp.content)["choices"][0]["message"]["content"]
             
         except Exception as e:
             logger.error(f"W&B inference API error: {e}")
@@ -273,39 +343,37 @@ class DeepSeekR1Service:
     
     async def _simulate_deepseek_response(self, messages: List[Dict[str, str]]) -> str:
         """Simulate context-aware medical assistant response"""
-        # Extract conversation context
-        conversation_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in messages])
         user_message = messages[-1]["content"].lower() if messages else ""
         
         # Check for emergency
-        emergency_keywords = ["emergency", "urgent", "911", "chest pain", "heart attack", "can't breathe", "severe pain"]
-        if any(keyword in user_message for keyword in emergency_keywords):
+        if _contains_any(user_message, EMERGENCY_KEYWORDS, EMERGENCY_AC):
             return "🚨 This sounds like a medical emergency. Please call 911 or go to your nearest emergency room immediately. I cannot provide emergency medical care."
         
-        # Context-aware responses based on conversation flow
-        conversation_lower = conversation_text.lower()
-        
         # If this is a greeting
-        if any(greeting in user_message for greeting in ["hi", "hello", "hey", "good morning", "good afternoon"]):
+        if _contains_any(user_message, GREETING_KEYWORDS, GREETING_AC):
             return "Hello! I'm PatientHero, your healthcare assistant. I'm here to help you get the medical care you need. To get started, could you tell me about any health concerns or symptoms you're experiencing?"
         
+        # Context-aware responses based on conversation flow; only built once
+        # the early-return branches above have been ruled out
+        conversation_lower = "\n".join([f"{msg['role']}: {msg['content']}" for msg in messages]).lower()
+        
         # If they mentioned a symptom and this is follow-up information
-        if any(symptom in conversation_lower for symptom in ["headache", "pain", "fever", "sick", "hurt", "symptom"]):
+        if _contains_any(conversation_lower, MENTIONED_SYMPTOM_KEYWORDS, MENTIONED_SYMPTOM_AC):
             # This is part of medical data collection
-            if "insurance" not in conversation_lower and any(word in user_message for word in ["started", "from", "since", "morning", "yesterday", "today", "hours", "days", "weeks", "ago", "this", "last"]):
+            if "insurance" not in conversation_lower and _contains_any(user_message, ONSET_KEYWORDS, ONSET_AC):
                 return f"Thank you for that information. I understand your symptoms started {user_message}. To help connect you with the right healthcare provider, I'll need a few more details:\n\n• What type of health insurance do you have? (e.g., Blue Cross, Aetna, Medicare, uninsured)\n• What's your zip code so I can find nearby providers?\n• What's the best way for a healthcare provider to contact you?\n\nLet's start with your insurance information."
             
-            elif "zip" not in conversation_lower and any(insurance in user_message for insurance in ["blue cross", "aetna", "medicare", "medicaid", "uninsured", "no insurance", "cigna", "humana"]):
+            elif "zip" not in conversation_lower and _contains_any(user_message, INSURANCE_KEYWORDS, INSURANCE_AC):
                 return f"Got it, you have {user_message} insurance. Now I need your zip code to find healthcare providers in your area. What's your zip code?"
             
             elif "contact" not in conversation_lower and len(user_message) == 5 and user_message.isdigit():
                 return f"Perfect! I have your zip code as {user_message}. Finally, what's the best way for a healthcare provider to contact you? Please provide either:\n• Your phone number\n• Your email address"
             
-            elif any(contact in user_message for contact in ["@", "phone", "email", "-", "("]) or user_message.replace("-", "").replace("(", "").replace(")", "").replace(" ", "").isdigit():
+            elif _contains_any(user_message, CONTACT_KEYWORDS, CONTACT_AC) or user_message.replace("-", "").replace("(", "").replace(")", "").replace(" ", "").isdigit():
                 return f"Excellent! I now have all the information needed:\n✅ Symptoms: From our conversation\n✅ Insurance: Mentioned earlier\n✅ Location: Your zip code\n✅ Contact: {user_message}\n\nBased on this information, I can help connect you with appropriate healthcare providers in your area. Would you like me to find nearby doctors or urgent care centers for your symptoms?"
         
         # If they mentioned a new symptom (first detection)
-        if any(symptom in user_message for symptom in ["headache", "pain", "fever", "sick", "hurt", "nausea", "dizzy", "cough", "sore throat", "ache"]):
+        if _contains_any(user_message, NEW_SYMPTOM_KEYWORDS, NEW_SYMPTOM_AC):
             return f"I understand you're experiencing {user_message}. I want to help you get the right medical care for this concern. To connect you with appropriate healthcare providers, I'll need to gather a few details:\n\n1. Could you tell me more about when your symptoms started?\n2. What type of health insurance do you have?\n3. What's your zip code so I can find nearby providers?\n4. What's the best way for a healthcare provider to contact you?\n\nLet's start with more details about when your symptoms began."
         
         # Default response for unclear input
@@ -314,6 +382,9 @@ class DeepSeekR1Service:
 # Global service instance
 deepseek_service: Optional[DeepSeekR1Service] = None
 
+# Set once Weave has been initialized at startup
+_WEAVE_READY = False
+
 def generate_demo_medical_response(user_message: str) -> str:
     """Generate a demo medical response when W&B is not configured"""
     return generate_demo_response(user_message, "DeepSeek R1 (Demo Mode)")
@@ -321,13 +392,21 @@ def generate_demo_medical_response(user_message: str) -> str:
 @app.on_event("startup")
 async def startup_event():
     """Initialize DeepSeek R1 service on startup"""
-    global deepseek_service
+    global deepseek_service, _WEAVE_READY
     
     # Get configuration from environment
     config = DeepSeekConfig(
         wandb_api_key=os.getenv("WANDB_API_KEY", ""),
         wandb_entity=os.getenv("WANDB_ENTITY", ""),
-        wandb_project=os.getenv("WANDB_PROJECT", "patienthero-deepseek")
+        wandb_project=os.getenv("WANDB_PROJECT", "patienthero-deepseek"),
+        remote_inference=os.getenv("WANDB_REMOTE_INFERENCE", "0") == "1"
+    )
+    
+    # One pooled HTTP/2 client for all upstream inference calls
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        timeout=30.0,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
     )
     
     if not config.wandb_api_key or config.wandb_api_key == "your_wandb_api_key_here":
@@ -343,6 +422,20 @@ async def startup_event():
         logger.warning(f"DeepSeek R1 service initialization had issues: {e} - continuing in demo mode")
         # Create a minimal service instance for demo mode
         deepseek_service = None
+    
+    # Initialize Weave once instead of on every logged request
+    try:
+        weave.init(project_name="PatientHero-Prompts")
+        _WEAVE_READY = True
+    except Exception as e:
+        logger.warning(f"Weave initialization failed: {e} - prompt logging disabled")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Close the pooled HTTP client"""
+    http = getattr(app.state, "http", None)
+    if http is not None:
+        await http.aclose()
 
 @app.get("/")
 async def root():
@@ -364,68 +457,71 @@ async def health_check():
         "version": "1.0.0"
     }
 
-@app.post("/v1/chat/completions", response_model=ChatResponse)
-async def chat_completions(request: ChatRequest):
+# ChatResponse documents the schema only; the plain dict is returned without re-validation
+@app.post("/v1/chat/completions", responses={200: {"model": ChatResponse}})
+async def chat_completions(request: ChatRequest, background_tasks: BackgroundTasks):
     """OpenAI-compatible chat completions endpoint"""
     global deepseek_service, conversation_cache
     try:
         # Generate a simple conversation ID based on the first user message
-        conversation_id = str(hash(request.messages[0].content if request.messages else "default"))[:8]
+        # (blake2b is stable across workers and restarts, unlike the salted built-in hash)
+        first_content = request.messages[0].content if request.messages else "default"
+        conversation_id = hashlib.blake2b(first_content.encode("utf-8"), digest_size=4).hexdigest()
         
-        # Get cached conversation if it exists
+        # Get cached conversation if it exists, marking it most recently used
         cached_conversation = conversation_cache.get(conversation_id, [])
+        if cached_conversation:
+            conversation_cache.move_to_end(conversation_id)
         
-        # Redact and check all user messages for PII and prompt injection
-        sanitized_messages = []
-        for msg in request.messages:
-            sanitized_content = safe_redact_and_check(msg.content)
-            sanitized_messages.append(ChatMessage(role=msg.role, content=sanitized_content))
-
-        # Combine cached conversation with new messages
-        all_messages = []
-        for cached_msg in cached_conversation:
-            all_messages.append(ChatMessage(role=cached_msg["role"], content=cached_msg["content"]))
-        
-        # Add new messages (skip system message if already in cache)
-        for msg in sanitized_messages:
-            if msg.role != "system" or not cached_conversation:
-                all_messages.append(msg)
+        # Redact and check all user messages for PII and prompt injection,
+        # skipping the system message if the conversation is already cached
+        new_messages = [
+            {"role": msg.role, "content": safe_redact_and_check(msg.content)}
+            for msg in request.messages
+            if msg.role != "system" or not cached_conversation
+        ]
 
-        # Generate response using actual LLM
-        if deepseek_service:
-            response_text = await deepseek_service.chat_completion(
-                all_messages,
-                max_tokens=request.max_tokens,
-                temperature=request.temperature,
-                top_p=request.top_p
-            )
-        else:
+        # Combine cached conversation with new messages (plain dicts, no model round-trip)
+        all_messages = cached_conversation + new_messages
+
+        if not deepseek_service:
             # If service is not available, return error instead of demo
             raise HTTPException(status_code=503, detail="AI service temporarily unavailable")
 
+        # Completion ID from the latest message and the current time, without stringifying the request
+        completion_hash = hashlib.blake2b(request.messages[-1].content.encode("utf-8") if request.messages else b"", digest_size=4)
+        completion_hash.update(time.time_ns().to_bytes(8, "little"))
+        completion_id = f"chatcmpl-{completion_hash.hexdigest()}"
+
+        if request.stream:
+            return StreamingResponse(
+                _stream_completion(completion_id, conversation_id, new_messages, all_messages, request, background_tasks),
+                media_type="text/event-stream"
+            )
+
+        # Generate response using actual LLM
+        response_text = await deepseek_service.chat_completion(
+            all_messages,
+            max_tokens=request.max_tokens,
+            temperature=request.temperature,
+            top_p=request.top_p
+        )
+
         # Redact/check response for PII and prompt injection before returning
         safe_response_text = safe_redact_and_check(response_text)
 
-        # Update conversation cache with new messages and response
-        conversation_cache[conversation_id] = []
-        for msg in all_messages:
-            conversation_cache[conversation_id].append({"role": msg.role, "content": msg.content})
-        conversation_cache[conversation_id].append({"role": "assistant", "content": safe_response_text})
-        
-        # Keep only last 10 messages to prevent memory issues
-        if len(conversation_cache[conversation_id]) > 10:
-            conversation_cache[conversation_id] = conversation_cache[conversation_id][-10:]
+        _finish_conversation(conversation_id, new_messages, all_messages, safe_response_text, background_tasks)
 
-        # Log prompt and response to Weave
-        log_to_weave(
-            prompt="\n".join([m.content for m in all_messages]),
-            response=safe_response_text
-        )
+        # Approximate token usage, counted once
+        prompt_tokens = sum(len(msg["content"].split()) for msg in all_messages)
+        completion_tokens = len(safe_response_text.split())
 
         # Format response
-        return ChatResponse(
-            id=f"chatcmpl-{hash(str(request.messages)) % 1000000}",
-            choices=[{
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "model": "llama-3.3-70b",
+            "choices": [{
                 "index": 0,
                 "message": {
                     "role": "assistant",
@@ -433,16 +529,73 @@ async def chat_completions(request: ChatRequest):
                 },
                 "finish_reason": "stop"
             }],
-            usage={
-                "prompt_tokens": sum(len(msg.content.split()) for msg in all_messages),
-                "completion_tokens": len(safe_response_text.split()),
-                "total_tokens": sum(len(msg.content.split()) for msg in all_messages) + len(safe_response_text.split())
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
             }
-        )
+        }
     except Exception as e:
         logger.error(f"Error in chat completion: {e}")
         raise HTTPException(status_code=500, detail=f"Error generating response: {str(e)}")
 
+def _finish_conversation(conversation_id: str, new_messages: List[Dict[str, str]], all_messages: List[Dict[str, str]],
+                         safe_response_text: str, background_tasks: BackgroundTasks):
+    """Cache the exchange and schedule the Weave log"""
+    # Update conversation cache in place with new messages and response
+    cache_entry = conversation_cache.setdefault(conversation_id, [])
+    conversation_cache.move_to_end(conversation_id)
+    cache_entry.extend(new_messages)
+    cache_entry.append({"role": "assistant", "content": safe_response_text})
+    
+    # Keep only the last messages per conversation, and evict least recently used conversations
+    del cache_entry[:-MAX_CACHED_MESSAGES]
+    while len(conversation_cache) > MAX_CACHED_CONVERSATIONS:
+        conversation_cache.popitem(last=False)
+
+    # Log prompt and response to Weave after the response has been sent
+    if _WEAVE_READY:
+        background_tasks.add_task(
+            log_to_weave,
+            prompt="\n".join([m["content"] for m in all_messages]),
+            response=safe_response_text
+        )
+
+def _sse_chunk(completion_id: str, delta: Dict[str, str], finish_reason: Optional[str] = None) -> bytes:
+    """Format one OpenAI-compatible chat.completion.chunk server-sent event"""
+    chunk = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "model": "llama-3.3-70b",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }
+    return b"data: " + orjson.dumps(chunk) + b"\n\n"
+
+async def _stream_completion(completion_id: str, conversation_id: str, new_messages: List[Dict[str, str]],
+                             all_messages: List[Dict[str, str]], request: ChatRequest,
+                             background_tasks: BackgroundTasks) -> AsyncIterator[bytes]:
+    """Stream the completion as server-sent events, caching the full reply once it ends"""
+    parts = []
+    try:
+        async for safe_chunk in guard_stream(deepseek_service.stream_chat_completion(
+            all_messages,
+            max_tokens=request.max_tokens,
+            temperature=request.temperature,
+            top_p=request.top_p
+        )):
+            parts.append(safe_chunk)
+            yield _sse_chunk(completion_id, {"content": safe_chunk})
+    except Exception as e:
+        # Headers are already sent, so end the stream instead of raising a 500
+        logger.error(f"Error in streaming chat completion: {e}")
+        yield _sse_chunk(completion_id, {}, finish_reason="error")
+        yield b"data: [DONE]\n\n"
+        return
+
+    _finish_conversation(conversation_id, new_messages, all_messages, "".join(parts), background_tasks)
+    yield _sse_chunk(completion_id, {}, finish_reason="stop")
+    yield b"data: [DONE]\n\n"
+
 @app.get("/v1/models")
 async def list_models():
     """List available models (OpenAI-compatible)"""
@@ -461,29 +614,60 @@ async def list_models():
         ]
     }
 
+# Simple heuristic: suspicious prompt injection phrases, matched as lowercase substrings
+INJECTION_KEYWORDS = (
+    "ignore previous instructions", "disregard above", "override", "forget previous", "as an ai", "repeat this prompt", "simulate", "act as", "you are now"
+)
+
+_INJECTION_AC = _build_automaton(INJECTION_KEYWORDS)
+
 def is_prompt_injection(text: str) -> bool:
     """Detect basic prompt injection attempts."""
-    # Simple heuristic: look for suspicious prompt injection patterns
-    injection_patterns = [
-        "ignore previous instructions", "disregard above", "override", "forget previous", "as an ai", "repeat this prompt", "simulate", "act as", "you are now"
-    ]
-    lowered = text.lower()
-    return any(pattern in lowered for pattern in injection_patterns)
+    return _contains_any(text.lower(), INJECTION_KEYWORDS, _INJECTION_AC)
+
 
+INJECTION_BLOCKED_MESSAGE = "[Blocked: Potential prompt injection detected.]"
 
 def safe_redact_and_check(text: str) -> str:
     """Redact PII and block prompt injection."""
     if is_prompt_injection(text):
-        return "[Blocked: Potential prompt injection detected.]"
+        return INJECTION_BLOCKED_MESSAGE
     if has_pii(text):
         return redact_pii(text)
     return text
 
 
+# Raw text kept from earlier chunks so an injection phrase split across chunks is still seen whole
+_INJECTION_SCAN_OVERLAP = max(len(keyword) for keyword in INJECTION_KEYWORDS) - 1
+
+async def guard_stream(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Redact PII and block prompt injection in a streamed reply, yielding the text that is safe to send."""
+    # Raw text is buffered until it can be redacted without splitting a PII match; the held-back
+    # tail is longer than any injection phrase, so a phrase is caught before any of it is sent
+    pending = ""
+    scan_tail = ""
+    async for chunk in chunks:
+        scan_window = scan_tail + chunk
+        if is_prompt_injection(scan_window):
+            # Like the non-streaming path, nothing after the phrase reaches the client
+            yield INJECTION_BLOCKED_MESSAGE
+            if hasattr(chunks, "aclose"):
+                await chunks.aclose()
+            return
+        scan_tail = scan_window[-_INJECTION_SCAN_OVERLAP:]
+
+        redacted, pending = split_redacted_prefix(pending + chunk)
+        if redacted:
+            yield redacted
+    if pending:
+        yield redact_pii(pending)
+
+
 def log_to_weave(prompt: str, response: str, user_id: Optional[str] = None):
     """Log prompt and response to Weave for monitoring."""
+    if not _WEAVE_READY:
+        return
     try:
-        weave.init(project_name="PatientHero-Prompts")
         weave.log({
             "prompt": prompt,
             "response": response,
@@ -495,9 +679,14 @@ def log_to_weave(prompt: str, response: str, user_id: Optional[str] = None):
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8001))  # Changed default port to 8001
+    dev = os.getenv("DEV", "0") == "1"
     uvicorn.run(
         "wandb_deepseek_service:app",
         host="0.0.0.0",
         port=port,
-        reload=True
+        reload=dev,
+        # uvloop/httptools ship with uvicorn[standard]; reload only supports a single worker
+        workers=1 if dev else int(os.getenv("WORKERS", 4)),
+        loop="uvloop",
+        http="httptools"
     )
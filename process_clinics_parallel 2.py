@@ -15,6 +15,7 @@ from typing import Dict, List, Any, Optional
 from playwright.async_api import async_playwright
 from bs4 import BeautifulSoup
 import openai
+import orjson
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -24,12 +25,30 @@ openai.api_key = os.getenv('OPENAI_API_KEY')
 # Constants
 INPUT_FILE = 'processed_medical_data.json'
 OUTPUT_FILE = 'processed_medical_data_with_appointments.json'
+RAW_RESULTS_FILE = 'processed_medical_data_with_appointments_raw.ndjson'  # One raw result per line, written as clinics finish
 MAX_CONCURRENT_TASKS = 3  # Limit concurrent browser instances to avoid rate limiting
 REQUEST_TIMEOUT = 30000  # 30 seconds timeout for each page
+BLOCKED_RESOURCE_TYPES = {'image', 'font', 'media'}  # Only visible text is needed
+SCRAPE_DEBUG = bool(os.getenv('SCRAPE_DEBUG'))  # Save a screenshot of every clinic page
+SCREENSHOT_DIR = 'screenshots'
+
+if SCRAPE_DEBUG:
+    os.makedirs(SCREENSHOT_DIR, exist_ok=True)
 
 # Global browser instance to be shared across tasks
 browser = None
 
+# Pool of reusable browser contexts, one per concurrency slot
+context_pool: Optional[asyncio.Queue] = None
+
+async def block_heavy_resources(route) -> None:
+    """Abort requests for images, fonts and media; let everything else through."""
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
 class ClinicProcessor:
     """Handles processing of individual clinic websites."""
     
@@ -37,19 +56,39 @@ class ClinicProcessor:
     async def extract_appointment_slots(page) -> List[Dict[str, Any]]:
         """Extract appointment slots from the booking section."""
         try:
-            # Wait for potential dynamic content to load
-            await page.wait_for_load_state('networkidle')
+            # Wait briefly for anything that could hold a time slot; networkidle
+            # can stall for the full timeout on pages with persistent trackers
+            try:
+                await page.wait_for_selector('button, a[href], [class*="time"], [class*="slot"]', timeout=3000)
+            except Exception:
+                pass  # Extract from whatever has rendered so far
             
             # Take a screenshot for debugging
-            timestamp = int(time.time())
-            os.makedirs('screenshots', exist_ok=True)
-            screenshot_path = f'screenshots/appointments_{timestamp}.png'
-            await page.screenshot(path=screenshot_path)
+            if SCRAPE_DEBUG:
+                timestamp = int(time.time())
+                screenshot_path = f'{SCREENSHOT_DIR}/appointments_{timestamp}.png'
+                await page.screenshot(path=screenshot_path)
             
-            # Try to extract slots using multiple approaches
+            # Scan the page text once; only walk the DOM if it finds nothing
             slots = await page.evaluate('''() => {
+                const text = document.body.innerText;
+                const timeRegex = /\\b\\d{1,2}:?\\d{0,2}\\s*[AP]M?\\b/gi;
+                const uniqueTimes = new Set();
                 const results = [];
                 
+                for (const match of text.matchAll(timeRegex)) {
+                    if (!uniqueTimes.has(match[0])) {
+                        uniqueTimes.add(match[0]);
+                        results.push({
+                            time: match[0],
+                            source: 'text_extraction',
+                            element: 'N/A'
+                        });
+                    }
+                }
+                
+                if (results.length > 0) return results;
+                
                 // Function to check if element is visible
                 const isVisible = (elem) => {
                     if (!elem) return false;
@@ -59,8 +98,8 @@ class ClinicProcessor:
                            style.opacity !== '0';
                 };
                 
-                // Look for time slot buttons or links
-                const timePattern = /(\d{1,2}:?\d{0,2}\s*[AP]M?)/i;
+                // Fall back to time slot buttons or links, which keeps element provenance
+                const timePattern = /(\\d{1,2}:?\\d{0,2}\\s*[AP]M?)/i;
                 const selectors = [
                     'button', 'a', 'div[role="button"]', 
                     'div[class*="time"]', 'div[class*="slot"]',
@@ -69,7 +108,6 @@ class ClinicProcessor:
                     'div[class*="appointment"]', 'div[class*="book"]'
                 ];
                 
-                // Check all elements that might contain time slots
                 for (const sel of selectors) {
                     const elements = document.querySelectorAll(sel);
                     for (const el of elements) {
@@ -86,24 +124,6 @@ class ClinicProcessor:
                     }
                 }
                 
-                // If no slots found, try to extract from page text
-                if (results.length === 0) {
-                    const text = document.body.innerText;
-                    const timeRegex = /(\d{1,2}:?\d{0,2}\s*[AP]M?)/gi;
-                    const matches = text.matchAll(timeRegex);
-                    const uniqueTimes = new Set();
-                    
-                    for (const match of matches) {
-                        uniqueTimes.add(match[0]);
-                    }
-                    
-                    return Array.from(uniqueTimes).map(time => ({
-                        time: time,
-                        source: 'text_extraction',
-                        element: 'N/A'
-                    }));
-                }
-                
                 return results;
             }''')
             
@@ -116,7 +136,6 @@ class ClinicProcessor:
     @classmethod
     async def process_clinic(cls, clinic_data: Dict[str, Any]) -> Dict[str, Any]:
         """Process a single clinic's website and return updated clinic data with appointments."""
-        global browser
         
         url = clinic_data.get('website')
         if not url:
@@ -125,9 +144,10 @@ class ClinicProcessor:
         
         print(f"\nProcessing: {clinic_data.get('name')} - {url}")
         
+        # Borrow a context from the pool instead of starting a new one per clinic
+        context = await context_pool.get()
+        page = None
         try:
-            # Create a new page in the shared browser
-            context = await browser.new_context()
             page = await context.new_page()
             
             # Set timeout for navigation
@@ -141,10 +161,6 @@ class ClinicProcessor:
             print("  Extracting appointment slots...")
             slots = await cls.extract_appointment_slots(page)
             
-            # Close the page and context
-            await page.close()
-            await context.close()
-            
             # Prepare result
             result = {
                 **clinic_data,
@@ -164,55 +180,67 @@ class ClinicProcessor:
                 'status': 'error',
                 'last_checked': datetime.now().isoformat()
             }
+        finally:
+            # Close the page and hand the context back to the pool
+            if page:
+                await page.close()
+            context_pool.put_nowait(context)
 
 
 async def process_clinics_parallel(clinics: List[Dict[str, Any]], max_concurrent: int = MAX_CONCURRENT_TASKS) -> List[Dict[str, Any]]:
     """Process multiple clinic websites in parallel with rate limiting."""
-    global browser
+    global browser, context_pool
     
     # Initialize Playwright browser
     print("\nLaunching browser...")
     playwright = await async_playwright().start()
     browser = await playwright.chromium.launch(headless=True)
     
+    # Create the context pool once; each concurrent task borrows one
+    context_pool = asyncio.Queue()
+    for _ in range(max_concurrent):
+        context = await browser.new_context(viewport={'width': 800, 'height': 600})
+        await context.route('**/*', block_heavy_resources)
+        context_pool.put_nowait(context)
+    
+    # Stream raw results to NDJSON so partial progress survives a crash
+    raw_out = open(RAW_RESULTS_FILE, 'wb')
+    
     try:
-        # Process clinics in batches to avoid overwhelming the system
-        results = []
-        total_clinics = len(clinics)
+        # Bound concurrency with a semaphore so each finished clinic frees its slot
+        # immediately, instead of waiting on the slowest clinic in a fixed batch
+        semaphore = asyncio.Semaphore(max_concurrent)
+        results: List[Optional[Dict[str, Any]]] = [None] * len(clinics)
         
-        for i in range(0, total_clinics, max_concurrent):
-            batch = clinics[i:i + max_concurrent]
-            print(f"\nProcessing batch {i//max_concurrent + 1}/{(total_clinics + max_concurrent - 1)//max_concurrent}")
-            
-            # Process batch in parallel
-            batch_results = await asyncio.gather(
-                *[ClinicProcessor.process_clinic(clinic) for clinic in batch],
-                return_exceptions=True
-            )
-            
-            # Handle any exceptions in the batch
-            for j, result in enumerate(batch_results):
-                if isinstance(result, Exception):
-                    clinic_name = batch[j].get('name', 'Unknown')
-                    print(f"Error processing {clinic_name}: {str(result)}")
-                    results.append({
-                        **batch[j],
-                        'error': str(result),
+        async def run(index: int, clinic: Dict[str, Any]):
+            async with semaphore:
+                try:
+                    return index, await ClinicProcessor.process_clinic(clinic)
+                except Exception as e:
+                    print(f"Error processing {clinic.get('name', 'Unknown')}: {str(e)}")
+                    return index, {
+                        **clinic,
+                        'error': str(e),
                         'status': 'error',
                         'last_checked': datetime.now().isoformat()
-                    })
-                else:
-                    results.append(result)
-            
-            # Small delay between batches
-            if i + max_concurrent < total_clinics:
-                print("Waiting before next batch...")
-                await asyncio.sleep(2)
+                    }
+        
+        tasks = [asyncio.create_task(run(i, clinic)) for i, clinic in enumerate(clinics)]
+        for completed, task in enumerate(asyncio.as_completed(tasks), 1):
+            index, result = await task
+            # Keep the input order in the returned list; the NDJSON follows completion order
+            results[index] = result
+            raw_out.write(orjson.dumps(result) + b'\n')
+            raw_out.flush()
+            print(f"Completed {completed}/{len(clinics)} clinics")
         
         return results
         
     finally:
         # Clean up
+        raw_out.close()
+        while not context_pool.empty():
+            await context_pool.get_nowait().close()
         if browser:
             await browser.close()
         await playwright.stop()
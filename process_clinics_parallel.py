@@ -3,34 +3,88 @@
 Parallel Clinic Appointment Scraper
 
 This script processes multiple clinic websites in parallel to extract appointment availability
-and saves the results to a JSON file.
+and saves the results to a JSON Lines file.
 """
 import asyncio
+import atexit
+import hashlib
 import json
+import logging
+import logging.handlers
 import os
+import queue
 import re
+import sys
 import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass
 from datetime import datetime
-from typing import Dict, List, Any, Optional
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
 
+import httpx
 from playwright.async_api import async_playwright
 from bs4 import BeautifulSoup
 import google.generativeai as genai
 from dotenv import load_dotenv
 
+try:
+    import ijson  # Optional: incremental parsing of large input files
+except ImportError:
+    ijson = None
+
+try:
+    import orjson  # Optional: faster JSON parsing and serialization
+except ImportError:
+    orjson = None
+
+try:
+    import diskcache  # Optional: on-disk cache of recent per-URL scrape results
+except ImportError:
+    diskcache = None
+
+try:
+    import uvloop  # Optional: faster event loop when run as a script
+except ImportError:
+    uvloop = None
+
 # Load environment variables
 load_dotenv()
+
 # openai.api_key = os.getenv('OPENAI_API_KEY')
 gemini_api_key = os.getenv('GEMINI_API_KEY')
 
+# Log through a queue so concurrent workers only enqueue records; a listener
+# thread does the actual writes to stderr
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
 # Constants
 INPUT_FILE = 'processed_medical_data.json'
-OUTPUT_FILE = 'processed_medical_data_with_appointments.json'
+OUTPUT_FILE = 'processed_medical_data_with_appointments.ndjson'  # One cleaned clinic per line
 MAX_CONCURRENT_TASKS = 3  # Limit concurrent browser instances to avoid rate limiting
 REQUEST_TIMEOUT = 30000  # 30 seconds timeout for each page
+STATIC_FETCH_TIMEOUT = 5.0  # Seconds for the plain-HTTP pre-flight fetch
+STATIC_PAGE_MAX_BYTES = 500_000  # Larger pages go through the browser
+SCRAPE_CACHE_DIR = './.scrape_cache'
+SCRAPE_CACHE_TTL = int(os.getenv('SCRAPE_CACHE_TTL', 900))  # Seconds a URL's scrape result is reused
+SCRAPED_FIELDS = ('appointment_slots', 'status', 'last_checked')  # What the cache stores per URL
+GEMINI_BATCH_SIZE = int(os.getenv('GEMINI_BATCH_SIZE', 6))  # Clinic pages analyzed per Gemini call
+GEMINI_BATCH_WAIT = 2.0  # Seconds a partial batch waits for more pages before it is sent
+GEMINI_BATCH_PAGE_CHARS = 4000  # Per-clinic text limit inside a batched prompt
+
+# Markers of client-rendered apps whose HTML lacks the real content
+HYDRATION_MARKERS = ('__NEXT_DATA__', '__NUXT__', 'data-reactroot', 'ng-version', 'id="root"', 'id="app"')
 
-# Global browser instance to be shared across tasks
-browser = None
+# Loaded clinics keyed by the input file's (mtime_ns, size), so repeat API calls skip parsing
+_clinics_cache: Optional[Tuple[Tuple[int, int], List[Dict[str, Any]]]] = None
 
 class ClinicProcessor:
     """Handles processing of individual clinic websites."""
@@ -50,7 +104,7 @@ class ClinicProcessor:
                 try:
                     element = await page.wait_for_selector(selector, timeout=3000)
                     if element:
-                        print("  Found appointment link, navigating...")
+                        logger.info("  Found appointment link, navigating...")
                         await element.click()
                         await page.wait_for_load_state('networkidle', timeout=10000)
                         return True
@@ -89,6 +143,9 @@ class ClinicProcessor:
         cleaned_slots = []
         
         for slot in slots:
+            # Only dict slots leave this method, so downstream cleaning can skip type checks
+            if not isinstance(slot, dict):
+                continue
             time_str = slot.get('time', '').strip()
             
             # Skip obviously invalid times
@@ -184,12 +241,12 @@ class ClinicProcessor:
                 response = await model.generate_content_async(prompt)
                 response_text = response.text.strip()
             except Exception as async_e:
-                print(f"Async Gemini call failed: {async_e}, trying sync fallback...")
+                logger.warning(f"Async Gemini call failed: {async_e}, trying sync fallback...")
                 import asyncio
                 response = await asyncio.to_thread(model.generate_content, prompt)
                 response_text = response.text.strip()
             # Debug: Print the LLM response
-            print(f"    Gemini LLM Response: {response_text[:200]}...")
+            logger.info(f"    Gemini LLM Response: {response_text[:200]}...")
             # Clean up the response to ensure it's valid JSON
             if response_text.startswith('```json'):
                 response_text = response_text[7:]
@@ -200,100 +257,182 @@ class ClinicProcessor:
                 if isinstance(appointment_data, list):
                     return appointment_data
                 else:
-                    print(f"Unexpected response format: {type(appointment_data)}")
+                    logger.warning(f"Unexpected response format: {type(appointment_data)}")
                     return []
             except json.JSONDecodeError as e:
-                print(f"Failed to parse Gemini response as JSON: {e}")
-                print(f"Response was: {response_text}")
+                logger.error(f"Failed to parse Gemini response as JSON: {e}")
+                logger.warning(f"Response was: {response_text}")
                 return []
         except Exception as e:
-            print(f"Error calling Gemini API: {str(e)}")
+            logger.error(f"Error calling Gemini API: {str(e)}")
             return []
 
     @staticmethod
-    async def extract_appointment_slots_with_llm(page) -> List[Dict[str, Any]]:
-        """Extract appointment slots using LLM to analyze webpage content (now uses Gemini)."""
+    async def analyze_appointments_batch(texts: List[str]) -> List[List[Dict[str, Any]]]:
+        """Use one Gemini call to extract appointment times from several clinic pages, one slot list per page."""
+        if len(texts) == 1:
+            return [await ClinicProcessor.analyze_appointments_with_gemini(texts[0])]
+        
         try:
-            # Wait for content to load
-            await page.wait_for_load_state('networkidle')
-            
-            # Get page content
-            page_text = await page.inner_text('body')
-            
-            # Debug: Print page length and sample content
-            print(f"    Page content length: {len(page_text)} characters")
-            page_sample = page_text.replace('\n', ' ')[:300] + "..." if len(page_text) > 300 else page_text
-            print(f"    Page sample: {page_sample}")
-            
-            # Create a cleaned version of the text for LLM analysis
-            # Remove excessive whitespace and limit content size
-            cleaned_text = re.sub(r'\s+', ' ', page_text).strip()
-            
-            # Limit text size to avoid token limits (keep first 8000 chars which is ~2000 tokens)
-            if len(cleaned_text) > 8000:
-                cleaned_text = cleaned_text[:8000] + "..."
+            genai.configure(api_key=gemini_api_key)
+            model = genai.GenerativeModel('models/gemini-2.5-flash')
+            clinic_sections = "\n\n".join(
+                f"=== CLINIC {i} ===\n{text[:GEMINI_BATCH_PAGE_CHARS]}" for i, text in enumerate(texts)
+            )
+            prompt = f"""
+            Analyze the following {len(texts)} medical/healthcare website contents and extract any available appointment time slots for each clinic separately.
+
+            Look for:
+            1. Specific appointment times (e.g., \"9:00 AM\", \"2:30 PM\", \"14:00\")
+            2. Available time slots for booking
+            3. Schedule information or office hours that could indicate availability
+            4. Time-based availability or mentions of \"available\", \"open\", \"slots\"
+            5. Business hours that suggest when appointments might be available
+
+            IMPORTANT RULES:
+            - Only use a clinic's own content for its slots
+            - Extract actual appointment times when found
+            - If no specific appointment times are found, but office hours are mentioned, extract those as potential appointment windows
+            - Times should be in standard format (e.g., \"9:00 AM\", \"2:30 PM\")
+            - If the page mentions \"call to schedule\" or similar, and shows office hours, use those hours as potential appointment times
+
+            Return a JSON object with one entry per clinic:
+            {{
+                \"results\": [
+                    {{
+                        \"clinic_index\": 0,
+                        \"slots\": [
+                            {{
+                                \"time\": \"formatted time (e.g., 9:00 AM)\",
+                                \"confidence\": \"high|medium|low\",
+                                \"context\": \"brief context where this time was found\",
+                                \"source\": \"llm_extraction\"
+                            }}
+                        ]
+                    }}
+                ]
+            }}
+
+            If no time-related information is found for a clinic, give it an empty \"slots\" array.
+
+            {clinic_sections}
+
+            Response (JSON only, no other text):
+            """
+            try:
+                response = await model.generate_content_async(prompt)
+                response_text = response.text.strip()
+            except Exception as async_e:
+                logger.warning(f"Async Gemini batch call failed: {async_e}, trying sync fallback...")
+                response = await asyncio.to_thread(model.generate_content, prompt)
+                response_text = response.text.strip()
+            logger.info(f"    Gemini batch response for {len(texts)} clinics: {response_text[:200]}...")
+            if response_text.startswith('```json'):
+                response_text = response_text[7:]
+            if response_text.endswith('```'):
+                response_text = response_text[:-3]
             
-            # Check if page has any time-related content
-            time_keywords = ['time', 'hour', 'appointment', 'schedule', 'book', 'available', 'AM', 'PM']
-            has_time_content = any(keyword.lower() in cleaned_text.lower() for keyword in time_keywords)
-            print(f"    Page has time-related content: {has_time_content}")
+            batch_data = json.loads(response_text)
+            results: List[List[Dict[str, Any]]] = [[] for _ in texts]
+            for entry in batch_data.get('results', []) if isinstance(batch_data, dict) else []:
+                if not isinstance(entry, dict):
+                    continue
+                index = entry.get('clinic_index')
+                slots = entry.get('slots')
+                if isinstance(index, int) and 0 <= index < len(texts) and isinstance(slots, list):
+                    results[index] = slots
+            return results
+        except Exception as e:
+            # Clinics without LLM slots fall back to regex extraction
+            logger.error(f"Error in batched Gemini analysis: {str(e)}")
+            return [[] for _ in texts]
+
+    @staticmethod
+    def prepare_page_text(page_text: str) -> str:
+        """Collapse whitespace and trim page text to what is sent to the LLM."""
+        # Debug: Print page length and sample content
+        logger.info(f"    Page content length: {len(page_text)} characters")
+        page_sample = page_text.replace('\n', ' ')[:300] + "..." if len(page_text) > 300 else page_text
+        logger.info(f"    Page sample: {page_sample}")
+        
+        # Create a cleaned version of the text for LLM analysis
+        # Remove excessive whitespace and limit content size
+        cleaned_text = re.sub(r'\s+', ' ', page_text).strip()
+        
+        # Limit text size to avoid token limits (keep first 8000 chars which is ~2000 tokens)
+        if len(cleaned_text) > 8000:
+            cleaned_text = cleaned_text[:8000] + "..."
+        
+        # Check if page has any time-related content
+        time_keywords = ['time', 'hour', 'appointment', 'schedule', 'book', 'available', 'AM', 'PM']
+        has_time_content = any(keyword.lower() in cleaned_text.lower() for keyword in time_keywords)
+        logger.info(f"    Page has time-related content: {has_time_content}")
+        
+        return cleaned_text
+
+    @staticmethod
+    async def extract_appointment_slots_with_llm(page_text: str,
+                                                 analyze: Optional[Callable[[str], Awaitable[List[Dict[str, Any]]]]] = None) -> List[Dict[str, Any]]:
+        """Extract appointment slots using LLM to analyze webpage content (Gemini, or a batcher's analyze)."""
+        try:
+            cleaned_text = ClinicProcessor.prepare_page_text(page_text)
+            if not cleaned_text:
+                return []
             
             # Use Gemini to extract appointment information
-            appointment_data = await ClinicProcessor.analyze_appointments_with_gemini(cleaned_text)
-            
-            return appointment_data
+            analyze = analyze or ClinicProcessor.analyze_appointments_with_gemini
+            return await analyze(cleaned_text)
             
         except Exception as e:
-            print(f"Error in LLM extraction: {str(e)}")
+            logger.error(f"Error in LLM extraction: {str(e)}")
             return []
     
     @staticmethod
-    async def extract_appointment_slots(page) -> List[Dict[str, Any]]:
-        """Extract appointment slots - now using LLM as primary method with fallback."""
+    async def read_page_text(page) -> str:
+        """Read the visible text of a loaded page, or an empty string if it cannot be read."""
         try:
-            # Get the current page URL for reference
-            current_url = page.url
-            
-            # First try LLM extraction
-            llm_slots = await ClinicProcessor.extract_appointment_slots_with_llm(page)
-            
-            if llm_slots and len(llm_slots) > 0:
-                print(f"  LLM found {len(llm_slots)} appointment slots")
-                # Clean and validate the LLM results
-                cleaned_slots = []
-                for slot in llm_slots:
-                    if isinstance(slot, dict) and slot.get('time'):
-                        # Add standard fields
-                        cleaned_slot = {
-                            'time': slot['time'],
-                            'source': 'llm_extraction',
-                            'booking_available': True,
-                            'slot_type': 'appointment',
-                            'confidence': slot.get('confidence', 'medium'),
-                            'context': slot.get('context', '')
-                        }
-                        cleaned_slots.append(cleaned_slot)
-                return cleaned_slots
-            
-            # Fallback to basic extraction if LLM fails
-            print("  LLM extraction yielded no results, trying fallback method...")
-            fallback_slots = await ClinicProcessor.extract_appointment_slots_fallback(page)
-            
-            # If fallback also fails, generate realistic appointment times with website reference
-            if not fallback_slots:
-                print("  No slots found - may be blocked by website or no online booking available...")
-                fallback_slots = ClinicProcessor.generate_realistic_appointment_slots(current_url)
-            
-            return fallback_slots
-            
+            # Wait for content to load, then read the page text once for all extraction methods
+            await page.wait_for_load_state('networkidle')
+            return await page.inner_text('body')
         except Exception as e:
-            print(f"Error in appointment extraction: {str(e)}")
-            # Generate fallback slots even on error, with URL reference
-            try:
-                current_url = page.url
-            except:
-                current_url = None
-            return ClinicProcessor.generate_realistic_appointment_slots(current_url)
+            logger.error(f"Error reading page text: {str(e)}")
+            return ''
+    
+    @staticmethod
+    async def extract_appointment_slots_from_text(page_text: str, current_url: Optional[str],
+                                                  analyze: Optional[Callable[[str], Awaitable[List[Dict[str, Any]]]]] = None) -> List[Dict[str, Any]]:
+        """Extract appointment slots from page text - LLM first, then regex, then generated slots."""
+        # First try LLM extraction
+        llm_slots = await ClinicProcessor.extract_appointment_slots_with_llm(page_text, analyze)
+        
+        if llm_slots and len(llm_slots) > 0:
+            logger.info(f"  LLM found {len(llm_slots)} appointment slots")
+            # Clean and validate the LLM results
+            cleaned_slots = []
+            for slot in llm_slots:
+                if isinstance(slot, dict) and slot.get('time'):
+                    # Add standard fields
+                    cleaned_slot = {
+                        'time': slot['time'],
+                        'source': 'llm_extraction',
+                        'booking_available': True,
+                        'slot_type': 'appointment',
+                        'confidence': slot.get('confidence', 'medium'),
+                        'context': slot.get('context', '')
+                    }
+                    cleaned_slots.append(cleaned_slot)
+            return cleaned_slots
+        
+        # Fallback to basic extraction if LLM fails
+        logger.info("  LLM extraction yielded no results, trying fallback method...")
+        fallback_slots = ClinicProcessor.extract_appointment_slots_fallback(page_text)
+        
+        # If fallback also fails, generate realistic appointment times with website reference
+        if not fallback_slots:
+            logger.info("  No slots found - may be blocked by website or no online booking available...")
+            fallback_slots = ClinicProcessor.generate_realistic_appointment_slots(current_url)
+        
+        return fallback_slots
     
     @staticmethod
     def generate_realistic_appointment_slots(website_url: str = None) -> List[Dict[str, Any]]:
@@ -320,18 +459,13 @@ class ClinicProcessor:
                 'website_note': f'Visit {website_url} for actual appointment booking' if website_url else None
             })
         
-        print(f"  Generated {len(slots)} realistic appointment slots")
+        logger.info(f"  Generated {len(slots)} realistic appointment slots")
         return slots
     
     @staticmethod
-    async def extract_appointment_slots_fallback(page) -> List[Dict[str, Any]]:
+    def extract_appointment_slots_fallback(page_text: str) -> List[Dict[str, Any]]:
         """Fallback appointment extraction using improved regex patterns."""
         try:
-            await page.wait_for_load_state('networkidle')
-            
-            # Get page text content
-            page_text = await page.inner_text('body')
-            
             # Improved time patterns that are more specific
             time_patterns = [
                 r'\b(\d{1,2}:\d{2}\s*[AP]M)\b',          # 12:30 PM, 9:00 AM
@@ -383,7 +517,7 @@ class ClinicProcessor:
             return unique_slots[:10]  # Limit to 10 slots
             
         except Exception as e:
-            print(f"Error in fallback extraction: {str(e)}")
+            logger.error(f"Error in fallback extraction: {str(e)}")
             return []
     
     @staticmethod
@@ -417,253 +551,503 @@ class ClinicProcessor:
         
         return None
     
+    @staticmethod
+    def html_to_text(html: str) -> str:
+        """Extract the visible text from an HTML document."""
+        soup = BeautifulSoup(html, 'html.parser')
+        for tag in soup(['script', 'style', 'noscript']):
+            tag.decompose()
+        return soup.get_text('\n')
+    
     @classmethod
-    async def process_clinic(cls, clinic_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Process a single clinic's website and return updated clinic data with appointments."""
-        global browser
-        
-        url = clinic_data.get('website')
-        if not url:
-            print(f"No website URL for {clinic_data.get('name')}")
-            return {**clinic_data, 'error': 'No website URL provided'}
-        
-        print(f"\nProcessing: {clinic_data.get('name')} - {url}")
+    async def fetch_static_page_text(cls, http_client: httpx.AsyncClient, url: str) -> Optional[str]:
+        """Fetch a page over plain HTTP and return its text if it is static HTML that mentions appointments."""
+        try:
+            response = await http_client.get(url, timeout=STATIC_FETCH_TIMEOUT)
+            if (response.status_code != 200
+                    or 'text/html' not in response.headers.get('content-type', '')
+                    or len(response.content) > STATIC_PAGE_MAX_BYTES):
+                return None
+            
+            html = response.text
+            if 'appointment' not in html.lower() or any(marker in html for marker in HYDRATION_MARKERS):
+                return None
+            
+            return await asyncio.to_thread(cls.html_to_text, html)
+        except Exception:
+            # Any network or parsing problem just means using the browser
+            return None
+    
+    @classmethod
+    async def fetch_clinic_page_text(cls, url: str, browser, http_client: Optional[httpx.AsyncClient] = None) -> Tuple[str, str]:
+        """Get a clinic page's text and final URL, over plain HTTP if static or in its own browser context."""
+        # Static pages that already mention appointments skip the browser entirely
+        page_text = await cls.fetch_static_page_text(http_client, url) if http_client else None
+        if page_text is not None:
+            logger.info("  Static page, extracting appointment slots without a browser...")
+            return page_text, url
         
+        # Create a new context and page in the shared browser
+        context = await browser.new_context()
         try:
-            # Create a new page in the shared browser
-            context = await browser.new_context()
             page = await context.new_page()
             
             # Set timeout for navigation
             page.set_default_timeout(REQUEST_TIMEOUT)
             
             # Navigate to the clinic's website
-            print(f"  Navigating to {url}...")
+            logger.info(f"  Navigating to {url}...")
             await page.goto(url, wait_until='domcontentloaded')
             
             # Try to navigate to appointment booking page
             await cls.try_navigate_to_appointments(page)
             
-            # Extract appointment slots
-            print("  Extracting appointment slots...")
-            slots = await cls.extract_appointment_slots(page)
-            
-            # Filter and clean the slots
-            cleaned_slots = cls.clean_appointment_slots(slots)
-            
-            # Close the page and context
-            await page.close()
+            logger.info("  Reading page text...")
+            return await cls.read_page_text(page), page.url
+        finally:
+            # Closing the context also closes its page
             await context.close()
-            
-            # Prepare result
-            result = {
-                **clinic_data,
-                'appointment_slots': cleaned_slots,
-                'last_checked': datetime.now().isoformat(),
-                'status': 'success' if cleaned_slots else 'no_slots_found'
-            }
-            
-            print(f"  Found {len(cleaned_slots)} valid appointment slots")
-            return result
-            
+    
+    @classmethod
+    async def build_clinic_result(cls, clinic_data: Dict[str, Any], page_text: str, current_url: Optional[str],
+                                  analyze: Optional[Callable[[str], Awaitable[List[Dict[str, Any]]]]] = None) -> Dict[str, Any]:
+        """Extract, clean and attach appointment slots from a clinic's page text."""
+        logger.info(f"  Extracting appointment slots for {clinic_data.get('name')}...")
+        slots = await cls.extract_appointment_slots_from_text(page_text, current_url, analyze)
+        
+        # Filter and clean the slots
+        cleaned_slots = cls.clean_appointment_slots(slots)
+        
+        logger.info(f"  Found {len(cleaned_slots)} valid appointment slots")
+        return {
+            **clinic_data,
+            'appointment_slots': cleaned_slots,
+            'last_checked': datetime.now().isoformat(),
+            'status': 'success' if cleaned_slots else 'no_slots_found'
+        }
+    
+    @staticmethod
+    def error_result(clinic_data: Dict[str, Any], error: Exception) -> Dict[str, Any]:
+        """Result for a clinic whose page could not be processed."""
+        return {
+            **clinic_data,
+            'error': str(error),
+            'status': 'error',
+            'last_checked': datetime.now().isoformat()
+        }
+    
+    @classmethod
+    async def process_clinic(cls, clinic_data: Dict[str, Any], browser, http_client: Optional[httpx.AsyncClient] = None,
+                             analyze: Optional[Callable[[str], Awaitable[List[Dict[str, Any]]]]] = None) -> Dict[str, Any]:
+        """Process a single clinic's website, over plain HTTP if static or in its own browser context."""
+        
+        url = clinic_data.get('website')
+        if not url:
+            logger.warning(f"No website URL for {clinic_data.get('name')}")
+            return {**clinic_data, 'error': 'No website URL provided'}
+        
+        logger.info(f"Processing: {clinic_data.get('name')} - {url}")
+        
+        try:
+            page_text, current_url = await cls.fetch_clinic_page_text(url, browser, http_client)
+            return await cls.build_clinic_result(clinic_data, page_text, current_url, analyze)
         except Exception as e:
-            print(f"Error processing {url}: {str(e)}")
-            return {
-                **clinic_data,
-                'error': str(e),
-                'status': 'error',
-                'last_checked': datetime.now().isoformat()
-            }
+            logger.error(f"Error processing {url}: {str(e)}")
+            return cls.error_result(clinic_data, e)
 
 
-async def process_clinics_parallel(clinics: List[Dict[str, Any]], max_concurrent: int = MAX_CONCURRENT_TASKS) -> List[Dict[str, Any]]:
-    """Process multiple clinic websites in parallel with rate limiting."""
-    global browser
+class GeminiBatcher:
+    """Collects page texts from concurrently scraped clinics and analyzes them in batched Gemini calls."""
     
-    # Initialize Playwright browser
-    print("\nLaunching browser...")
-    playwright = await async_playwright().start()
-    browser = await playwright.chromium.launch(headless=True)
+    def __init__(self, batch_size: int = GEMINI_BATCH_SIZE, max_wait: float = GEMINI_BATCH_WAIT):
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_timer: Optional[asyncio.TimerHandle] = None
+        self._calls: set = set()  # Keeps in-flight batch calls referenced until they finish
     
-    try:
-        # Process clinics in batches to avoid overwhelming the system
-        results = []
-        total_clinics = len(clinics)
+    async def analyze(self, page_text: str) -> List[Dict[str, Any]]:
+        """Queue a page text for the next batch and wait for its slots."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((page_text, future))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+        elif self._flush_timer is None:
+            # Don't hold a partial batch back longer than max_wait
+            self._flush_timer = loop.call_later(self.max_wait, self.flush)
+        return await future
+    
+    def flush(self) -> None:
+        """Send the pending page texts as one batch."""
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            call = asyncio.create_task(self._run(batch))
+            self._calls.add(call)
+            call.add_done_callback(self._calls.discard)
+    
+    def cancel(self) -> None:
+        """Drop pending page texts and stop in-flight batch calls."""
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        for _, future in self._pending:
+            future.cancel()
+        self._pending = []
+        for call in self._calls:
+            call.cancel()
+    
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        logger.info(f"  Analyzing {len(batch)} clinic pages in one Gemini call...")
+        try:
+            results = await ClinicProcessor.analyze_appointments_batch([text for text, _ in batch])
+        except Exception as e:
+            logger.error(f"Error in batched Gemini analysis: {str(e)}")
+            results = [[] for _ in batch]
+        for (_, future), slots in zip(batch, results):
+            if not future.done():
+                future.set_result(slots)
+
+
+def normalize_url(url: str) -> str:
+    """Normalize a URL so trivially different spellings of the same page compare equal."""
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/'), parts.query, ''))
+
+
+def scrape_cache_key(url: str) -> str:
+    """Key for a URL in the scrape cache."""
+    return hashlib.blake2b(normalize_url(url).encode('utf-8'), digest_size=16).hexdigest()
+
+
+async def process_clinics_parallel(clinics: List[Dict[str, Any]], browser, http_client: Optional[httpx.AsyncClient] = None,
+                                   max_concurrent: int = MAX_CONCURRENT_TASKS, cache=None) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+    """Process multiple clinic websites in parallel with rate limiting, yielding (index, result) as each clinic finishes."""
+    # Hit each host one page at a time for politeness
+    host_locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+    
+    # Scraped fields per normalized URL, so clinics sharing a page are scraped once per run;
+    # a future because the first clinic's slots arrive only after its Gemini batch returns
+    scraped_this_run: Dict[str, asyncio.Future] = {}
+    
+    # Page texts from all workers are pooled into batched Gemini calls
+    batcher = GeminiBatcher()
+    
+    # A bounded work queue drained by max_concurrent long-lived workers; each worker
+    # picks up the next clinic as soon as it has its page text, leaving the LLM step to a task
+    work_queue: asyncio.Queue = asyncio.Queue(maxsize=max_concurrent * 2)
+    done_queue: asyncio.Queue = asyncio.Queue()
+    finishing: set = set()
+    
+    def finish_later(coro) -> None:
+        task = asyncio.create_task(coro)
+        finishing.add(task)
+        task.add_done_callback(finishing.discard)
+    
+    def cache_get(cache_key: str) -> Optional[Dict[str, Any]]:
+        # The cache dir is shared with other processes; a busy or broken cache just means scraping
+        try:
+            return cache.get(cache_key)
+        except Exception as e:
+            logger.warning(f"Scrape cache read failed, scraping instead: {str(e)}")
+            return None
+    
+    def cache_set(cache_key: str, scraped: Dict[str, Any]) -> None:
+        try:
+            cache.set(cache_key, scraped, expire=SCRAPE_CACHE_TTL)
+        except Exception as e:
+            logger.warning(f"Scrape cache write failed: {str(e)}")
+    
+    async def finish(index: int, clinic: Dict[str, Any], page_text: str, current_url: str,
+                     normalized_url: str, shared: asyncio.Future, cache_key: Optional[str]) -> None:
+        result = None
+        scraped = None
+        try:
+            result = await ClinicProcessor.build_clinic_result(clinic, page_text, current_url, batcher.analyze)
+            if result.get('status') in ('success', 'no_slots_found'):
+                scraped = {field: result[field] for field in SCRAPED_FIELDS}
+                if cache_key:
+                    cache_set(cache_key, scraped)
+        except Exception as e:
+            logger.error(f"Error processing {clinic.get('name', 'Unknown')}: {str(e)}")
+            result = ClinicProcessor.error_result(clinic, e)
+        finally:
+            # Every path must release same-URL clinics and count this one as done
+            if scraped is None:
+                # Let a later clinic with the same URL try again
+                scraped_this_run.pop(normalized_url, None)
+            if not shared.done():
+                shared.set_result(scraped)
+            done_queue.put_nowait((index, result or ClinicProcessor.error_result(clinic, RuntimeError('processing was interrupted'))))
+    
+    async def reuse(index: int, clinic: Dict[str, Any], shared: asyncio.Future) -> None:
+        try:
+            scraped = await shared
+        except Exception as e:
+            done_queue.put_nowait((index, ClinicProcessor.error_result(clinic, e)))
+            return
+        if scraped is None:
+            # The first clinic with this URL failed, so scrape it again
+            await work_queue.put((index, clinic))
+        else:
+            done_queue.put_nowait((index, {**clinic, **scraped}))
+    
+    async def process(index: int, clinic: Dict[str, Any]) -> None:
+        url = clinic.get('website') or ''
+        if not url:
+            done_queue.put_nowait((index, await ClinicProcessor.process_clinic(clinic, browser, http_client)))
+            return
         
-        for i in range(0, total_clinics, max_concurrent):
-            batch = clinics[i:i + max_concurrent]
-            print(f"\nProcessing batch {i//max_concurrent + 1}/{(total_clinics + max_concurrent - 1)//max_concurrent}")
-            
-            # Process batch in parallel
-            batch_results = await asyncio.gather(
-                *[ClinicProcessor.process_clinic(clinic) for clinic in batch],
-                return_exceptions=True
-            )
-            
-            # Handle any exceptions in the batch
-            for j, result in enumerate(batch_results):
-                if isinstance(result, Exception):
-                    clinic_name = batch[j].get('name', 'Unknown')
-                    print(f"Error processing {clinic_name}: {str(result)}")
-                    results.append({
-                        **batch[j],
-                        'error': str(result),
-                        'status': 'error',
-                        'last_checked': datetime.now().isoformat()
-                    })
-                else:
-                    results.append(result)
-            
-            # Small delay between batches
-            if i + max_concurrent < total_clinics:
-                print("Waiting before next batch...")
-                await asyncio.sleep(2)
+        # Reuse a recent scrape of the same URL; expired entries read as None
+        cache_key = scrape_cache_key(url) if cache is not None else None
+        if cache_key:
+            cached = cache_get(cache_key)
+            if cached is not None:
+                logger.info(f"Using cached scrape for {url}")
+                done_queue.put_nowait((index, {**clinic, **cached}))
+                return
+        
+        normalized_url = normalize_url(url)
+        if normalized_url in scraped_this_run:
+            finish_later(reuse(index, clinic, scraped_this_run[normalized_url]))
+            return
+        shared = scraped_this_run[normalized_url] = asyncio.get_running_loop().create_future()
+        
+        logger.info(f"Processing: {clinic.get('name')} - {url}")
+        try:
+            async with host_locks[urlsplit(url).netloc.lower()]:
+                page_text, current_url = await ClinicProcessor.fetch_clinic_page_text(url, browser, http_client)
+        except Exception as e:
+            logger.error(f"Error processing {url}: {str(e)}")
+            scraped_this_run.pop(normalized_url, None)
+            shared.set_result(None)
+            done_queue.put_nowait((index, ClinicProcessor.error_result(clinic, e)))
+            return
         
-        return results
+        finish_later(finish(index, clinic, page_text, current_url, normalized_url, shared, cache_key))
+    
+    async def worker():
+        while True:
+            index, clinic = await work_queue.get()
+            try:
+                await process(index, clinic)
+            except Exception as e:
+                # Never let one clinic kill the worker or drop it from the count
+                logger.error(f"Error processing {clinic.get('name', 'Unknown')}: {str(e)}")
+                done_queue.put_nowait((index, ClinicProcessor.error_result(clinic, e)))
+            finally:
+                work_queue.task_done()
+    
+    async def produce():
+        for item in enumerate(clinics):
+            await work_queue.put(item)
+    
+    workers = [asyncio.create_task(worker()) for _ in range(max_concurrent)]
+    producer = asyncio.create_task(produce())
+    try:
+        for completed in range(1, len(clinics) + 1):
+            index, result = await done_queue.get()
+            logger.info(f"Completed {completed}/{len(clinics)} clinics")
+            yield index, result
         
     finally:
         # Clean up
-        if browser:
-            await browser.close()
-        await playwright.stop()
+        producer.cancel()
+        for task in [*workers, *finishing]:
+            task.cancel()
+        batcher.cancel()
 
 
 def load_clinics() -> List[Dict[str, Any]]:
     """Load clinic data from the processed medical data JSON file."""
+    global _clinics_cache
     try:
-        with open(INPUT_FILE, 'r') as f:
-            data = json.load(f)
-            # Convert the medical data format to clinic format
+        stat = os.stat(INPUT_FILE)
+        cache_key = (stat.st_mtime_ns, stat.st_size)
+        if _clinics_cache and _clinics_cache[0] == cache_key:
+            return list(_clinics_cache[1])
+        
+        with open(INPUT_FILE, 'rb') as f:
+            # Stream records one at a time when ijson is available
+            if ijson:
+                data = ijson.items(f, 'item', use_float=True)
+            elif orjson:
+                data = orjson.loads(f.read())
+            else:
+                data = json.load(f)
+            # Convert the medical data format to clinic format, keeping only the fields
+            # used downstream so the source records can be freed
             clinics = []
             for item in data:
                 clinic = {
                     'name': item.get('hospital_name', ''),
                     'website': item.get('link', ''),
                     'institution_type': item.get('institution_type', ''),
-                    'accepts_user_insurance': item.get('accepts_user_insurance', 'unknown'),
-                    'original_data': item
+                    'accepts_user_insurance': item.get('accepts_user_insurance', 'unknown')
                 }
                 clinics.append(clinic)
-            return clinics
+            _clinics_cache = (cache_key, clinics)
+            return list(clinics)
     except Exception as e:
-        print(f"Error loading clinics: {str(e)}")
+        logger.error(f"Error loading clinics: {str(e)}")
         return []
 
 
 def save_results(processed_clinics: List[Dict[str, Any]]) -> None:
-    """Save the processed results to the output JSON file."""
+    """Save the processed results to the output file as JSON Lines, one compact object per clinic."""
     try:
-        with open(OUTPUT_FILE, 'w') as f:
-            json.dump(processed_clinics, f, indent=2)
-        print(f"\nResults saved to {OUTPUT_FILE}")
+        if orjson:
+            data = b''.join(orjson.dumps(clinic) + b'\n' for clinic in processed_clinics)
+        else:
+            data = b''.join(json.dumps(clinic, default=asdict).encode('utf-8') + b'\n' for clinic in processed_clinics)
+        
+        # Write a sibling temp file in one go and rename it over the output, so a crash
+        # mid-write never leaves readers a truncated file
+        tmp_file = OUTPUT_FILE + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, OUTPUT_FILE)
+        logger.info(f"Results saved to {OUTPUT_FILE}")
     except Exception as e:
-        print(f"Error saving results: {str(e)}")
+        logger.error(f"Error saving results: {str(e)}")
+
+
+@dataclass(slots=True)
+class AppointmentSlot:
+    """A cleaned appointment slot; serialized by orjson and FastAPI like the equivalent dict."""
+    time: str
+    source: str = 'website'
+    booking_available: bool = True
+    slot_type: str = 'appointment'
+
+
+@dataclass(slots=True)
+class NotedAppointmentSlot(AppointmentSlot):
+    """A generated slot that points the patient at the clinic's website."""
+    note: str = ''
+
+
+# Availability of a clinic without slots, which is most of them; copied per clinic.
+# The empty tuple is shared and serializes as []
+_EMPTY_AVAILABILITY = {
+    'available_slots': (),
+    'booking_method': 'unknown',
+    'next_available': None,
+    'total_slots_found': 0,
+    'booking_note': None
+}
 
 
 def clean_appointment_data(processed_clinics: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """Clean and standardize the appointment data extracted from clinic websites."""
+    """Clean and standardize the appointment data extracted from clinic websites (slots as produced by clean_appointment_slots)."""
     cleaned_clinics = []
+    append_clinic = cleaned_clinics.append
     
     for clinic in processed_clinics:
+        get = clinic.get
+        availability = _EMPTY_AVAILABILITY.copy()
         cleaned_clinic = {
-            'hospital_name': clinic.get('name', ''),
-            'website': clinic.get('website', ''),
-            'institution_type': clinic.get('institution_type', ''),
-            'accepts_user_insurance': clinic.get('accepts_user_insurance', 'unknown'),
-            'processing_status': clinic.get('status', 'unknown'),
-            'last_checked': clinic.get('last_checked', ''),
-            'appointment_availability': {
-                'available_slots': [],
-                'booking_method': 'unknown',
-                'next_available': None,
-                'total_slots_found': 0,
-                'booking_note': None
-            }
+            'hospital_name': get('name', ''),
+            'website': get('website', ''),
+            'institution_type': get('institution_type', ''),
+            'accepts_user_insurance': get('accepts_user_insurance', 'unknown'),
+            'processing_status': get('status', 'unknown'),
+            'last_checked': get('last_checked', ''),
+            'appointment_availability': availability
         }
         
-        # Process appointment slots
-        slots = clinic.get('appointment_slots', [])
-        cleaned_slots = []
-        has_website_reference = False
+        # Process appointment slots; clinics without any keep the empty availability
+        raw_slots = get('appointment_slots')
+        slots = [slot for slot in raw_slots if 'time' in slot] if raw_slots else None
         
-        for slot in slots:
-            if isinstance(slot, dict) and slot.get('time'):
-                cleaned_slot = {
-                    'time': slot['time'],
-                    'source': slot.get('source', 'website'),
-                    'booking_available': True,
-                    'slot_type': 'appointment'
-                }
-                
-                # Check if this is a generated slot with website reference
-                if slot.get('website_note'):
-                    has_website_reference = True
-                    cleaned_slot['note'] = slot.get('context', '')
-                
-                cleaned_slots.append(cleaned_slot)
-        
-        cleaned_clinic['appointment_availability']['available_slots'] = cleaned_slots
-        cleaned_clinic['appointment_availability']['total_slots_found'] = len(cleaned_slots)
-        
-        if cleaned_slots:
-            cleaned_clinic['appointment_availability']['next_available'] = cleaned_slots[0]['time']
+        if slots:
+            # Generated slots with a website reference keep their context as a note
+            cleaned_slots = [
+                NotedAppointmentSlot(slot['time'], slot.get('source', 'website'), note=slot.get('context', ''))
+                if slot.get('website_note') else AppointmentSlot(slot['time'], slot.get('source', 'website'))
+                for slot in slots
+            ]
+            has_website_reference = any(slot.get('website_note') for slot in slots)
+            
+            availability['available_slots'] = cleaned_slots
+            availability['total_slots_found'] = len(cleaned_slots)
+            availability['next_available'] = cleaned_slots[0].time
             
             # Set booking method and note based on source
             if has_website_reference:
-                cleaned_clinic['appointment_availability']['booking_method'] = 'visit_website'
-                cleaned_clinic['appointment_availability']['booking_note'] = f"Please visit {clinic.get('website', '')} directly to check availability and book appointments. Online booking system may be restricted."
+                availability['booking_method'] = 'visit_website'
+                availability['booking_note'] = f"Please visit {get('website', '')} directly to check availability and book appointments. Online booking system may be restricted."
             else:
-                cleaned_clinic['appointment_availability']['booking_method'] = 'online'
+                availability['booking_method'] = 'online'
         
         # Add error information if present
-        if clinic.get('error'):
+        if get('error'):
             cleaned_clinic['processing_error'] = clinic['error']
         
-        cleaned_clinics.append(cleaned_clinic)
+        append_clinic(cleaned_clinic)
     
     return cleaned_clinics
 
 
-async def main():
-    """Main function to run the script."""
+async def main(use_cache: bool = True):
+    """Main function to run the script; use_cache=False rescrapes every URL."""
     start_time = time.time()
     
     # Load clinic data from processed medical data
-    print(f"Loading clinics from {INPUT_FILE}...")
+    logger.info(f"Loading clinics from {INPUT_FILE}...")
     clinics = load_clinics()
     
     if not clinics:
-        print("No clinic data found or error loading file.")
+        logger.warning("No clinic data found or error loading file.")
         return []
     
-    print(f"\nProcessing {len(clinics)} medical institutions...")
-    
-    # Process clinics in parallel
-    processed_clinics = await process_clinics_parallel(clinics)
+    logger.info(f"Processing {len(clinics)} medical institutions...")
     
-    # Clean the appointment data
-    print("\nCleaning appointment data...")
-    cleaned_clinics = clean_appointment_data(processed_clinics)
+    # Launch one browser for the whole run; each clinic gets its own context,
+    # and static pages are fetched through one pooled HTTP client
+    logger.info("Launching browser...")
+    cache = diskcache.Cache(SCRAPE_CACHE_DIR) if diskcache and use_cache else None
+    async with async_playwright() as playwright, httpx.AsyncClient(http2=True, follow_redirects=True) as http_client:
+        browser = await playwright.chromium.launch(headless=True)
+        try:
+            # Process clinics in parallel, cleaning each clinic's appointment data as it
+            # finishes while the rest are still being scraped; kept in input order.
+            # Cleaning one clinic takes microseconds, so it runs inline rather than on a thread
+            cleaned_clinics = [None] * len(clinics)
+            async for index, result in process_clinics_parallel(clinics, browser, http_client, cache=cache):
+                cleaned_clinics[index] = clean_appointment_data([result])[0]
+        finally:
+            await browser.close()
+            if cache is not None:
+                cache.close()
     
-    # Save results
-    save_results(cleaned_clinics)
+    # Save results off the event loop
+    await asyncio.to_thread(save_results, cleaned_clinics)
     
     # Calculate and print total time
     total_time = time.time() - start_time
-    print(f"\nCompleted processing in {total_time:.2f} seconds")
+    logger.info(f"Completed processing in {total_time:.2f} seconds")
     
     # Return cleaned results for API integration
     return cleaned_clinics
 
 
-async def process_medical_institutions_for_api() -> List[Dict[str, Any]]:
+async def process_medical_institutions_for_api(use_cache: bool = True) -> List[Dict[str, Any]]:
     """Entry point for API calls to process medical institutions and return appointment data."""
     try:
-        return await main()
+        return await main(use_cache=use_cache)
     except Exception as e:
-        print(f"Error in process_medical_institutions_for_api: {str(e)}")
+        logger.error(f"Error in process_medical_institutions_for_api: {str(e)}")
         return []
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # Only install uvloop here; importers such as the API server keep their own loop
+    if uvloop:
+        uvloop.install()
+    asyncio.run(main(use_cache='--no-cache' not in sys.argv))
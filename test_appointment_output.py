@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Regression tests for cleaning scraped appointment data and the JSON Lines output files
+"""
+
+import importlib.util
+import json
+import os
+import tempfile
+from dataclasses import asdict
+
+import process_clinics_parallel as pcp
+
+
+def _clinic(**overrides):
+    clinic = {
+        "name": "Test Clinic",
+        "website": "https://clinic.example.org",
+        "institution_type": "hospital",
+        "accepts_user_insurance": "yes",
+        "status": "success",
+        "last_checked": "2025-01-01T09:00:00",
+    }
+    clinic.update(overrides)
+    return clinic
+
+
+def test_slots_without_time_are_dropped():
+    slots = [{"time": "9:00 AM", "source": "llm_extraction"}, {"source": "website"}, {"time": "2:30 PM"}]
+    cleaned = pcp.clean_appointment_data([_clinic(appointment_slots=slots)])[0]
+    availability = cleaned["appointment_availability"]
+    assert [slot.time for slot in availability["available_slots"]] == ["9:00 AM", "2:30 PM"]
+    assert availability["total_slots_found"] == 2
+    assert availability["next_available"] == "9:00 AM"
+    assert availability["booking_method"] == "online"
+
+
+def test_clinic_without_usable_slots_keeps_empty_availability():
+    for slots in (None, [], [{"source": "website"}]):
+        cleaned = pcp.clean_appointment_data([_clinic(appointment_slots=slots, error="timeout")])[0]
+        availability = cleaned["appointment_availability"]
+        assert list(availability["available_slots"]) == []
+        assert availability["total_slots_found"] == 0
+        assert availability["booking_method"] == "unknown"
+        assert cleaned["processing_error"] == "timeout"
+
+
+def test_generated_slots_point_to_website():
+    slots = [{"time": "10:00 AM", "source": "generated", "website_note": True, "context": "Call to book"}]
+    cleaned = pcp.clean_appointment_data([_clinic(appointment_slots=slots)])[0]
+    availability = cleaned["appointment_availability"]
+    assert asdict(availability["available_slots"][0])["note"] == "Call to book"
+    assert availability["booking_method"] == "visit_website"
+    assert "https://clinic.example.org" in availability["booking_note"]
+
+
+def test_results_are_saved_as_json_lines():
+    cleaned = pcp.clean_appointment_data([
+        _clinic(appointment_slots=[{"time": "9:00 AM"}]),
+        _clinic(name="Other Clinic", appointment_slots=[]),
+    ])
+    output_file = pcp.OUTPUT_FILE
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pcp.OUTPUT_FILE = os.path.join(tmp_dir, "appointments.ndjson")
+        try:
+            pcp.save_results(cleaned)
+            with open(pcp.OUTPUT_FILE) as f:
+                records = [json.loads(line) for line in f]
+            assert not os.path.exists(pcp.OUTPUT_FILE + ".tmp")
+        finally:
+            pcp.OUTPUT_FILE = output_file
+    assert [record["hospital_name"] for record in records] == ["Test Clinic", "Other Clinic"]
+    assert records[0]["appointment_availability"]["available_slots"][0]["time"] == "9:00 AM"
+    assert records[1]["appointment_availability"]["available_slots"] == []
+
+
+def test_raw_stream_does_not_overwrite_cleaned_output():
+    # The duplicate scraper streams raw records; they must never land in the file api_server serves
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "process_clinics_parallel 2.py")
+    spec = importlib.util.spec_from_file_location("process_clinics_parallel_2", path)
+    duplicate = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(duplicate)
+    assert duplicate.RAW_RESULTS_FILE != pcp.OUTPUT_FILE
+
+
+if __name__ == "__main__":
+    print("🧪 Testing appointment data cleaning and output files\n")
+    for test in (test_slots_without_time_are_dropped, test_clinic_without_usable_slots_keeps_empty_availability,
+                 test_generated_slots_point_to_website, test_results_are_saved_as_json_lines,
+                 test_raw_stream_does_not_overwrite_cleaned_output):
+        test()
+        print(f"✅ {test.__name__}")